@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+combine_mermaid_blocks.py - merge every ```mermaid flowchart block of a Markdown file into one .mmd diagram.
+
+- Works as a line-streaming pipeline: the Markdown is read line by line and the combined diagram is
+  written as it goes, so memory use does not grow with the input (multi-GB files are fine)
+- Each block becomes a `subgraph` titled after the closest preceding Markdown heading
+- Node ids are namespaced per block (b1_n0, b2_n0, ...) so blocks cannot collide
+- Non-flowchart blocks (sequenceDiagram, ...) cannot be nested in a flowchart and are listed as comments
+- Fine-detail region sub-charts of coarse py2mermaid charts (collapsed <details> titled "<chart> › Rk") would
+  only duplicate their coarse chart, so they are listed as comments too unless include_details is set
+- Optionally appends the non-mermaid Markdown text as %% comments (a second streaming pass)
+
+Works with py2mermaid output as well as hand-written Markdown. Id rewriting is a best-effort
+tokenizer for flowchart syntax: labels ("..." / [..] / (..) / {..} / |..| / -- text -->) are copied
+verbatim; `linkStyle` lines are dropped because link indices change once blocks are merged.
+
+Usage:
+  python combine_mermaid_blocks.py mermaid.md -o combined.mmd [--flow-dir LR] [--include-md-text] [--include-details]
+"""
+import re
+import sys
+import html
+import argparse
+from io import StringIO
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+HERE = Path(__file__).resolve().parent
+if str(HERE) not in sys.path:
+    sys.path.insert(0, str(HERE))
+
+from py2mermaid_v2 import AtomicTextWriter, DETAIL_MARKER
+
+_FENCE_RE = re.compile(r"^(`{3,}|~{3,})\s*([\w-]*)")
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.*?)\s*#*\s*$")
+_HEADER_RE = re.compile(r"^(flowchart|graph)\b", re.IGNORECASE)
+_SUMMARY_RE = re.compile(r"<summary>(.*?)</summary>", re.IGNORECASE)
+_WORD_RE = re.compile(r"[^\W]+(?:-(?!-)[^\W]+)*")  # ids may contain single dashes (my-node), not "--"
+_LINK_RE = re.compile(r"<?(?:-{2,}|={2,}|-\.+-|~{3,})[>ox]?|<?-\.+->")
+_LINK_END_RE = re.compile(r"-{2,}[>ox]?|={2,}[>ox]?|\.-+>?")
+_QUOTED_RE = re.compile(r'"(?:[^"\\]|\\.)*"?')
+_OPEN = {"[": "]", "(": ")", "{": "}"}
+
+# ---------------------------- Markdown scanning ---------------------------- #
+
+def iter_file_lines(path: Path) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", errors="replace", newline=None) as fh:
+        yield from fh
+
+def iter_events(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Turn Markdown lines into ("text", line) / ("open", info) / ("line", line) / ("close", "") events.
+    "open" carries the fence info string (e.g. "mermaid"); inner fenced lines of any language are
+    reported as "line" events so callers can skip or consume them without buffering.
+    """
+    fence = None
+    for raw in lines:
+        line = raw.rstrip("\r\n")
+        stripped = line.strip()
+        if fence is None:
+            m = _FENCE_RE.match(stripped)
+            if m:
+                fence = m.group(1)
+                yield "open", m.group(2).lower()
+            else:
+                yield "text", line
+        elif stripped.startswith(fence[0] * len(fence)) and not stripped.strip(fence[0]):
+            fence = None
+            yield "close", ""
+        else:
+            yield "line", line
+    if fence is not None:
+        yield "close", ""
+
+def iter_comment_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Non-fenced Markdown lines as Mermaid %% comments (fenced code of any language is dropped)."""
+    for kind, line in iter_events(lines):
+        if kind == "text":
+            yield "%%\n" if not line.strip() else f"%% {line}\n"
+
+# ---------------------------- id namespacing ---------------------------- #
+
+def _skip_quoted(line: str, i: int) -> int:
+    return _QUOTED_RE.match(line, i).end()
+
+def _skip_shape(line: str, i: int) -> int:
+    depth = 0
+    while i < len(line):
+        c = line[i]
+        if c == '"':
+            i = _skip_quoted(line, i)
+            continue
+        if c in _OPEN:
+            depth += 1
+        elif c in "])}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+def namespace_statement(line: str, prefix: str) -> str:
+    """Prefix every node id in one flowchart statement line; labels and operators are left untouched."""
+    out: List[str] = []
+    i, n = 0, len(line)
+    after_id = False
+    while i < n:
+        c = line[i]
+        if c == '"':
+            j = _skip_quoted(line, i)
+        elif c in _OPEN or (c == ">" and after_id):
+            j = _skip_shape(line, i) if c != ">" else (line.find("]", i) + 1 or n)
+        elif c == "|":
+            j = (line.find("|", i + 1) + 1) or n
+        elif line.startswith(":::", i):
+            m = _WORD_RE.match(line, i + 3)
+            j = m.end() if m else i + 3
+        elif c in "-=.<~" and _LINK_RE.match(line, i):
+            j = _LINK_RE.match(line, i).end()
+            op = line[i:j]
+            if op in ("--", "==", "-.") and j < n and line[j].isspace():
+                # "A -- text --> B": copy the text up to the closing half of the link
+                m = _LINK_END_RE.search(line, j)
+                j = m.end() if m else n
+        else:
+            m = _WORD_RE.match(line, i)
+            if m:
+                out.append(prefix + m.group())
+                i = m.end()
+                after_id = True
+                continue
+            j = i + 1
+        out.append(line[i:j])
+        after_id = False
+        i = j
+    return "".join(out)
+
+def namespace_line(line: str, prefix: str) -> Optional[str]:
+    """Rewrite one line of a flowchart body; returns None for lines that must be dropped."""
+    stripped = line.strip()
+    if not stripped or stripped.startswith("%%"):
+        return stripped
+    word = stripped.split(None, 1)[0]
+    rest = stripped[len(word):]
+    if word in ("end", "direction", "classDef"):
+        return stripped
+    if word == "linkStyle":
+        return f"%% dropped (link indices change when merged): {stripped}"
+    if word == "subgraph":
+        m = _WORD_RE.match(rest.lstrip())
+        if m:
+            head = rest.lstrip()
+            return f"subgraph {prefix}{m.group()}{head[m.end():]}"
+        return stripped
+    if word in ("style", "click"):
+        parts = rest.split(None, 1)
+        return f"{word} {prefix}{parts[0]}" + (f" {parts[1]}" if len(parts) > 1 else "")
+    if word == "class":
+        parts = rest.split(None, 1)
+        ids = ",".join(prefix + s.strip() for s in parts[0].split(",") if s.strip())
+        return f"class {ids}" + (f" {parts[1]}" if len(parts) > 1 else "")
+    return namespace_statement(stripped, prefix)
+
+# ---------------------------- combining ---------------------------- #
+
+def _subgraph_title(title: str) -> str:
+    return title.replace('"', "#quot;")
+
+def combine_stream(lines: Iterable[str], out: TextIO, flow_dir: str = "TD", include_details: bool = False) -> Tuple[int, int]:
+    """
+    Stream Markdown lines into one combined flowchart written to `out`.
+    Returns (combined, skipped) block counts; skipped blocks are non-flowchart diagrams and,
+    unless include_details, region sub-charts.
+    """
+    out.write(f"flowchart {flow_dir}\n")
+    combined = skipped = 0
+    heading = None
+    detail = None  # title of the region sub-chart the next block belongs to
+    state = None  # None | "head" | "front" | "body" | "skip"
+    prefix = ""
+    title = ""
+    for kind, line in iter_events(lines):
+        if kind == "text":
+            m = _HEADING_RE.match(line.strip())
+            if m:
+                heading = m.group(1)
+            m = _SUMMARY_RE.search(line)
+            if m and not include_details:
+                summary = html.unescape(m.group(1))
+                detail = summary if DETAIL_MARKER in summary else None
+        elif kind == "open":
+            state = "head" if line == "mermaid" else None
+            if state and detail is not None:
+                skipped += 1
+                out.write(f"    %% skipped region sub-chart: {detail}\n")
+                state = "skip"
+            detail = None
+        elif kind == "close":
+            if state == "body":
+                out.write("    end\n")
+            state = None
+        elif state == "head":
+            stripped = line.strip()
+            if not stripped or stripped.startswith("%%"):
+                continue
+            if stripped == "---":
+                state = "front"  # frontmatter config; not meaningful inside a subgraph
+            elif _HEADER_RE.match(stripped):
+                combined += 1
+                prefix = f"b{combined}_"
+                title = heading or f"block {combined + skipped}"
+                out.write(f'    subgraph b{combined}["{_subgraph_title(title)}"]\n')
+                state = "body"
+            else:
+                skipped += 1
+                title = heading or f"block {combined + skipped}"
+                out.write(f"    %% skipped non-flowchart block ({stripped.split()[0]}): {title}\n")
+                state = "skip"
+        elif state == "front":
+            if line.strip() == "---":
+                state = "head"
+        elif state == "body":
+            rewritten = namespace_line(line, prefix)
+            if rewritten:
+                indent = line[:len(line) - len(line.lstrip())]
+                out.write(f"    {indent}{rewritten}\n")
+    return combined, skipped
+
+def combine_markdown_file(md_path: Path,
+                          out_path: Path,
+                          flow_dir: str = "TD",
+                          include_md_text: bool = False,
+                          include_details: bool = False) -> Tuple[int, int, bool]:
+    """
+    Combine the mermaid blocks of md_path into out_path in constant memory (two streaming passes
+    when the Markdown text is appended as comments). Returns (combined, skipped, file_changed).
+    """
+    writer = AtomicTextWriter(out_path)
+    with writer as out:
+        combined, skipped = combine_stream(iter_file_lines(md_path), out, flow_dir=flow_dir, include_details=include_details)
+        if include_md_text:
+            out.write("\n%% ---- Non-mermaid Markdown (as comments) ----\n")
+            for line in iter_comment_lines(iter_file_lines(md_path)):
+                out.write(line)
+    return combined, skipped, writer.changed
+
+# ---------------------------- in-memory helpers ---------------------------- #
+
+def extract_blocks(md_text: str) -> List[str]:
+    """Return the body of every ```mermaid block in md_text."""
+    blocks: List[str] = []
+    current: Optional[List[str]] = None
+    for kind, line in iter_events(md_text.splitlines()):
+        if kind == "open":
+            current = [] if line == "mermaid" else None
+        elif kind == "close":
+            if current is not None:
+                blocks.append("\n".join(current))
+            current = None
+        elif kind == "line" and current is not None:
+            current.append(line)
+    return blocks
+
+def combine_blocks(blocks: Iterable[str], flow_dir: str = "TD") -> str:
+    """Combine already-extracted block bodies into one flowchart (same output as the streaming path)."""
+    buf = StringIO()
+    def lines() -> Iterator[str]:
+        for block in blocks:
+            yield "```mermaid"
+            yield from block.splitlines()
+            yield "```"
+    combine_stream(lines(), buf, flow_dir=flow_dir)
+    return buf.getvalue()
+
+# ---------------------------- CLI ---------------------------- #
+
+def main():
+    ap = argparse.ArgumentParser(description="Combine all ```mermaid flowchart blocks of a Markdown file into one .mmd diagram (streaming).")
+    ap.add_argument("markdown", help="input Markdown file")
+    ap.add_argument("-o", "--out", default="combined.mmd", help="output .mmd file")
+    ap.add_argument("--flow-dir", choices=["TB", "TD", "LR", "RL", "BT"], default="TD", help="flow direction for the combined diagram")
+    ap.add_argument("--include-md-text", action="store_true", help="append non-mermaid Markdown text as %% comments")
+    ap.add_argument("--include-details", action="store_true", help="also merge the region sub-charts of coarse py2mermaid charts")
+    args = ap.parse_args()
+
+    combined, skipped, changed = combine_markdown_file(Path(args.markdown), Path(args.out), args.flow_dir, args.include_md_text,
+                                                       args.include_details)
+    if not combined:
+        print(f"No ```mermaid flowchart blocks found in {args.markdown}", file=sys.stderr)
+        sys.exit(3)
+    note = "" if changed else " (unchanged)"
+    print(f"Combined {combined} block(s) ({skipped} non-flowchart / sub-chart skipped) -> {args.out}{note}")
+
+if __name__ == "__main__":
+    main()
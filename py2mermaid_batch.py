@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+py2mermaid_batch.py - generate py2mermaid_v2 reports for many project roots in one process.
+
+- One manifest (JSON) lists the roots and their per-root options
+- All roots share a single worker pool and a content-addressed chart cache (in memory + optional on disk),
+  so unchanged files are never re-parsed and identical files across repos are built once; files are
+  submitted to the pool as they are scanned, and files that fail to build are cached as failures
+- The Mermaid runtime is extracted once and written next to the reports as a shared mermaid.min.js
+- A top-level index.md / index.html links every repo's report
+
+Manifest example:
+{
+  "out_dir": "reports",
+  "cache_dir": ".py2mermaid-cache",
+  "workers": 8,
+  "mermaid_zip": "mermaid-11.10.0.zip",
+  "defaults": {"format": "both", "max_files": 500, "theme": "default", "max_file_bytes": 2000000, "file_time_budget": 30,
+               "io_threads": 8},
+  "roots": [
+    {"root": "../service-a"},
+    {"root": "../service-b", "name": "svc-b", "collapse": true, "ignore": "venv,tests", "detail": "fine"}
+  ]
+}
+Relative paths are resolved against the manifest's folder.
+
+Usage:
+  python py2mermaid_batch.py manifest.json [--workers 8] [--out-dir reports] [--cache-dir .py2mermaid-cache]
+"""
+import os
+import sys
+import time
+import json
+import html
+import hashlib
+import argparse
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+HERE = Path(__file__).resolve().parent
+if str(HERE) not in sys.path:
+    sys.path.insert(0, str(HERE))
+
+import py2mermaid_v2 as v2
+
+ROOT_DEFAULTS = {
+    "name": None,
+    "format": "both",
+    "max_files": 500,
+    "ignore": "venv,.venv,site-packages,__pycache__,.git,.hg,.mypy_cache,.pytest_cache",
+    "title": None,
+    "theme": "default",
+    "collapse": False,
+    "svg_cache_mb": 64,
+    "max_file_bytes": 2_000_000,
+    "include_generated": False,
+    "file_time_budget": 30.0,
+    "detail": "coarse",
+    "telemetry": False,
+    "io_threads": 8,
+}
+
+# Cached charts are only valid for the generator that produced them.
+GENERATOR_VERSION = v2.GENERATOR_VERSION
+
+class ChartCache:
+    """
+    Build results keyed by (file name, source hash, level of detail); kept in memory and, when cache_dir is
+    set, on disk. An entry is (charts, None) or (None, error message): files that cannot be charted
+    (syntax errors, ...) are not re-parsed on every run either.
+    """
+    def __init__(self, cache_dir: Path | None):
+        self.cache_dir = cache_dir
+        self.mem: dict[str, tuple[list[tuple[str, str]] | None, str | None]] = {}
+        self.hits = 0
+        if cache_dir:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(name: str, digest: str, detail: str) -> str:
+        h = hashlib.sha256(digest.encode("ascii"))
+        h.update(b"\0" + name.encode("utf-8") + b"\0" + detail.encode("ascii") + b"\0" + GENERATOR_VERSION.encode("ascii"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> tuple[list[tuple[str, str]] | None, str | None] | None:
+        entry = self.mem.get(key)
+        if entry is None and self.cache_dir:
+            p = self._path(key)
+            if p.exists():
+                try:
+                    doc = json.loads(p.read_text(encoding="utf-8"))
+                    charts = [tuple(c) for c in doc["charts"]] if doc.get("charts") is not None else None
+                    entry = (charts, doc.get("error"))
+                except (OSError, ValueError, TypeError, KeyError, AttributeError):
+                    entry = None  # torn or foreign entry: a miss, rebuilt and rewritten by put()
+                else:
+                    self.mem[key] = entry
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, charts: list[tuple[str, str]] | None, error: str | None = None) -> None:
+        self.mem[key] = (charts, error)
+        if self.cache_dir:
+            p = self._path(key)
+            p.parent.mkdir(exist_ok=True)
+            # atomic, so a crashed or concurrent run never leaves a half-written entry behind
+            v2.write_if_changed(p, json.dumps({"charts": charts, "error": error}, ensure_ascii=False))
+
+def _build_job(job: tuple[str, str, str, float, str]) -> tuple[list[tuple[str, str]] | None, str | None, bool]:
+    # Runs in a worker process: returns (charts, None, True) or (None, error message, cacheable).
+    # A blown time budget depends on machine load, so only that error is not cached.
+    src, name, filename, budget, detail = job
+    deadline = time.monotonic() + budget if budget else None
+    try:
+        graphs = v2.build_graphs_for_source(src, name, filename, deadline)
+        # rendered in the worker: the cache (and the pool's result pipe) holds Mermaid text
+        return [(title, g.to_mermaid()) for title, g in v2.charts_for_graphs(graphs, detail)], None, True
+    except v2.BuildBudgetExceeded:
+        return None, f"over the {budget:g}s time budget", False
+    except SyntaxError as e:
+        return None, f"syntax error: {e}", True
+    except (RecursionError, MemoryError):
+        return None, "too deeply nested to chart", True
+    except Exception as e:
+        return None, f"error: {e}", True
+
+def load_manifest(path: Path) -> dict:
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    base = path.resolve().parent
+    roots = []
+    used_names: set[str] = set()
+    for entry in manifest.get("roots", []):
+        if isinstance(entry, str):
+            entry = {"root": entry}
+        opts = dict(ROOT_DEFAULTS)
+        opts.update(manifest.get("defaults", {}))
+        opts.update(entry)
+        opts["root"] = (base / opts["root"]).resolve()
+        name = opts["name"] or opts["root"].name
+        while name in used_names:  # two roots with the same folder name
+            name += "_"
+        used_names.add(name)
+        opts["name"] = name
+        roots.append(opts)
+    manifest["roots"] = roots
+    for key in ("out_dir", "cache_dir", "mermaid_zip", "mermaid_js"):
+        if manifest.get(key):
+            manifest[key] = base / manifest[key]
+    return manifest
+
+def run_batch(manifest: dict, workers: int | None = None) -> list[dict]:
+    out_dir = Path(manifest.get("out_dir") or "py2mermaid-reports")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cache = ChartCache(Path(manifest["cache_dir"]) if manifest.get("cache_dir") else None)
+    workers = workers or manifest.get("workers")
+
+    # 1+2) scan every root and submit each uncached file to the shared pool as soon as it is read, so building
+    # overlaps scanning; at most 4 jobs per worker are in flight, so sources are never all held in memory
+    plans = []
+    errors: dict[str, str] = {}  # uncacheable failures (time budget) of this run
+    inflight: dict[Future, str] = {}
+    submitted: set[str] = set()
+    limit = 4 * (workers or os.cpu_count() or 1)
+
+    def harvest(done) -> None:
+        for fut in done:
+            key = inflight.pop(fut)
+            charts, err, cacheable = fut.result()
+            if cacheable:
+                cache.put(key, charts, err)
+            else:
+                errors[key] = err
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for opts in manifest["roots"]:
+            ignore = [s.strip() for s in (opts["ignore"] or "").split(",") if s.strip()]
+            accept = v2.FileFilter(opts["max_file_bytes"], skip_generated=not opts["include_generated"])
+            # files are read, filtered and decoded on io_threads threads while earlier ones are keyed
+            keyed = []
+            skipped = []
+            for f, src, digest, why in v2.prefetch_sources(v2.iter_py_files(opts["root"], ignore), accept, opts["io_threads"]):
+                if why is not None:
+                    skipped.append((f, why))
+                    continue
+                key = cache.key(f.name, digest, opts["detail"])
+                if key not in submitted and cache.get(key) is None:
+                    submitted.add(key)
+                    if len(inflight) >= limit:
+                        harvest(wait(inflight, return_when=FIRST_COMPLETED).done)
+                    inflight[pool.submit(_build_job, (src, f.name, str(f), opts["file_time_budget"], opts["detail"]))] = key
+                keyed.append((f, key))
+                if len(keyed) >= opts["max_files"]:
+                    break
+            plans.append((opts, keyed, skipped))
+            filtered = f", {len(skipped)} filtered" if skipped else ""
+            print(f"[scan] {opts['name']}: {len(keyed)} file(s){filtered}")
+        harvest(list(inflight))
+    print(f"[build] {len(submitted)} file(s) built, {cache.hits} cache hit(s)")
+
+    # 3) the Mermaid runtime is extracted once and shared by every report
+    mermaid_zip = manifest.get("mermaid_zip")
+    mermaid_js = manifest.get("mermaid_js")
+    runtime_src = None
+    js_inline = v2._read_mermaid_js(mermaid_zip, mermaid_js)
+    if js_inline is not None:
+        v2.write_if_changed(out_dir / "mermaid.min.js", js_inline)
+        runtime_src = "../mermaid.min.js"
+
+    # 4) per-root reports
+    summary = []
+    for opts, keyed, filtered in plans:
+        root_out = out_dir / opts["name"]
+        root_out.mkdir(parents=True, exist_ok=True)
+        for f, why in filtered:
+            print(f"[skip] {f} {why}", file=sys.stderr)
+        charts_by_file = {}
+        for f, key in keyed:
+            charts, err = cache.get(key) or (None, errors[key])
+            if err is not None:
+                print(f"[skip] {f} {err}", file=sys.stderr)
+            else:
+                charts_by_file[f] = charts
+        files = [f for f, _ in keyed if f in charts_by_file]
+        outputs = []
+        if opts["format"] in ("md", "both"):
+            v2.write_markdown(opts["root"], files, charts_by_file, root_out / "mermaid.md")
+            outputs.append("mermaid.md")
+        if opts["format"] in ("html", "both"):
+            v2.write_html(opts["root"], files, charts_by_file, root_out / "mermaid.html", mermaid_zip, mermaid_js,
+                          opts["title"], opts["theme"], opts["collapse"], opts["svg_cache_mb"], runtime_src,
+                          opts["telemetry"])
+            outputs.append("mermaid.html")
+        summary.append({
+            "name": opts["name"],
+            "root": str(opts["root"]),
+            "files": len(files),
+            "charts": sum(len(c) for c in charts_by_file.values()),
+            "skipped": len(keyed) - len(files) + len(filtered),
+            "outputs": outputs,
+        })
+        print(f"[write] {opts['name']}: {len(files)} file(s) -> {root_out}")
+
+    write_index(out_dir, summary)
+    return summary
+
+def write_index(out_dir: Path, summary: list[dict]) -> None:
+    md = ["# py2mermaid reports", "", "| Repository | Files | Charts | Skipped | Reports |", "|---|---:|---:|---:|---|"]
+    rows = []
+    for s in summary:
+        links_md = ", ".join(f"[{o}]({s['name']}/{o})" for o in s["outputs"])
+        md.append(f"| {s['name']} | {s['files']} | {s['charts']} | {s['skipped']} | {links_md} |")
+        links_html = ", ".join(f'<a href="{html.escape(s["name"])}/{o}">{o}</a>' for o in s["outputs"])
+        rows.append(f'<tr><td title="{html.escape(s["root"])}">{html.escape(s["name"])}</td>'
+                    f'<td>{s["files"]}</td><td>{s["charts"]}</td><td>{s["skipped"]}</td><td>{links_html}</td></tr>')
+    v2.write_if_changed(out_dir / "index.md", "\n".join(md) + "\n")
+    v2.write_if_changed(out_dir / "index.html", f"""<!doctype html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <title>py2mermaid reports</title>
+  <style>
+    body {{ font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 2rem; }}
+    table {{ border-collapse: collapse; }}
+    th, td {{ border: 1px solid #ddd; padding: .3rem .6rem; text-align: left; }}
+  </style>
+</head>
+<body>
+  <h1>py2mermaid reports</h1>
+  <table>
+    <tr><th>Repository</th><th>Files</th><th>Charts</th><th>Skipped</th><th>Reports</th></tr>
+    {chr(10).join(rows)}
+  </table>
+</body>
+</html>
+""")
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate py2mermaid_v2 reports for every root listed in a JSON manifest, sharing one worker pool, chart cache and Mermaid runtime.")
+    ap.add_argument("manifest", help="JSON manifest listing roots and per-root options")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (default: manifest 'workers' or CPU count)")
+    ap.add_argument("--out-dir", default=None, help="override the manifest's out_dir")
+    ap.add_argument("--cache-dir", default=None, help="override the manifest's cache_dir (persistent chart cache)")
+    args = ap.parse_args()
+
+    manifest = load_manifest(Path(args.manifest))
+    if args.out_dir:
+        manifest["out_dir"] = Path(args.out_dir)
+    if args.cache_dir:
+        manifest["cache_dir"] = Path(args.cache_dir)
+    if not manifest["roots"]:
+        print("Manifest lists no roots.", file=sys.stderr)
+        sys.exit(1)
+    summary = run_batch(manifest, args.workers)
+    print(f"[index] {len(summary)} repo(s) -> {Path(manifest.get('out_dir') or 'py2mermaid-reports') / 'index.html'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+py2mermaid_metrics.py - whole-run flowchart metrics from a batched CSR export (py2mermaid_v2 --csr-out).
+
+Every metric is computed for all functions of the run at once, in a few passes over the flat CSR arrays
+(no per-graph objects, no Mermaid re-parsing):
+- unreachable: statements no path reaches once `return`/`raise` edges only lead to End
+  (level-synchronous BFS from every Start node together; a `finally` is reached with its `try`)
+- cyclomatic:  McCabe E - N + 2 over the reachable part of each graph
+- loop_depth:  deepest loop nesting; each loop covers the node-index interval [header, after-loop node),
+  so one difference array + prefix sum gives the depth of every node
+- longest_path: edges on the longest acyclic Start -> End path; nodes are numbered in build order, so
+  dropping back edges (loops) leaves a DAG whose index order is a topological order
+
+Usage:
+  python py2mermaid_v2.py /path/to/project --csr-out run.csr
+  python py2mermaid_metrics.py run.csr [--csv metrics.csv] [--top 15]
+"""
+import io
+import csv
+import sys
+import argparse
+from array import array
+from itertools import accumulate, compress
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+if str(HERE) not in sys.path:
+    sys.path.insert(0, str(HERE))
+
+import py2mermaid_v2 as v2
+
+METRICS = ("cyclomatic", "loop_depth", "longest_path", "unreachable")
+_TERMINAL = v2.CSR_ROLE_RETURN | v2.CSR_ROLE_RAISE
+
+def _live_successors(csr: v2.GraphCSR, i: int):
+    # After return/raise only the edge to End is real; the builder also chains the next statement.
+    succ = csr.indices[csr.offsets[i]:csr.offsets[i + 1]]
+    if csr.roles[i] & _TERMINAL:
+        return [j for j in succ if csr.kinds[j] == v2.CSR_KIND_END]
+    return succ
+
+def finally_blocks(csr: v2.GraphCSR) -> dict[int, int]:
+    """try node -> its finally node. Try statements nest in build (index) order, so a stack pairs them."""
+    pairs: dict[int, int] = {}
+    stack: list[int] = []
+    marks = v2.CSR_ROLE_TRY | v2.CSR_ROLE_FINALLY | v2.CSR_ROLE_TRY_EXIT
+    for i in compress(range(len(csr.roles)), (r & marks for r in csr.roles)):
+        if csr.roles[i] & v2.CSR_ROLE_TRY:
+            stack.append(i)
+        elif stack:
+            t = stack.pop()
+            if csr.roles[i] & v2.CSR_ROLE_FINALLY:
+                pairs[t] = i
+    return pairs
+
+def reachable(csr: v2.GraphCSR) -> bytearray:
+    """
+    1 for every node reachable from its graph's Start node, for all graphs in one BFS.
+    Entering a try also reaches its finally, even when every path through the body returns or raises.
+    """
+    finally_of = finally_blocks(csr)
+    seen = bytearray(len(csr.kinds))
+    frontier = list(csr.graph_offsets[:-1])  # Start nodes
+    for i in frontier:
+        seen[i] = 1
+    while frontier:
+        nxt = []
+        for i in frontier:
+            succ = _live_successors(csr, i)
+            if i in finally_of:
+                succ = [*succ, finally_of[i]]
+            for j in succ:
+                if not seen[j]:
+                    seen[j] = 1
+                    nxt.append(j)
+        frontier = nxt
+    return seen
+
+def unreachable_counts(csr: v2.GraphCSR, seen: bytearray) -> tuple[list[int], list[int]]:
+    """Per graph: number of unreachable statements and the first source line among them (0 = none)."""
+    counts = [0] * len(csr.titles)
+    first = [0] * len(csr.titles)
+    for i in compress(range(len(seen)), (not s for s in seen)):
+        line = csr.lines[i]
+        if not line or csr.kinds[i] == v2.CSR_KIND_START:
+            continue  # synthesized nodes (End, joins) are not statements
+        g = csr.owner[i]
+        counts[g] += 1
+        if not first[g] or line < first[g]:
+            first[g] = line
+    return counts, first
+
+def cyclomatic(csr: v2.GraphCSR, seen: bytearray) -> list[int]:
+    edges = [0] * len(csr.titles)
+    nodes = [0] * len(csr.titles)
+    for i in compress(range(len(seen)), seen):
+        g = csr.owner[i]
+        nodes[g] += 1
+        edges[g] += len(_live_successors(csr, i))
+    return [e - n + 2 for e, n in zip(edges, nodes)]
+
+def loop_depth(csr: v2.GraphCSR) -> list[int]:
+    diff = array("i", bytes(4 * (len(csr.kinds) + 1)))
+    for h in compress(range(len(csr.roles)), (r & v2.CSR_ROLE_LOOP for r in csr.roles)):
+        exit_node = csr.indices[csr.offsets[h + 1] - 1]  # a loop header's last successor is its after-loop node
+        if exit_node > h:
+            diff[h] += 1
+            diff[exit_node] -= 1
+    depth = list(accumulate(diff))
+    bounds = csr.graph_offsets
+    return [max(depth[bounds[g]:bounds[g + 1]]) for g in range(len(csr.titles))]
+
+def longest_path(csr: v2.GraphCSR) -> list[int]:
+    """Edges on the longest acyclic Start -> End path per graph (-1 when End is unreachable)."""
+    kinds = csr.kinds
+    dist = array("i", [-1]) * len(kinds)
+    for s in csr.graph_offsets[:-1]:
+        dist[s] = 0
+    for i in range(len(kinds)):
+        d = dist[i]
+        if d < 0:
+            continue
+        for j in _live_successors(csr, i):
+            # forward edges only; End sits at index start + 1 but is always the last node of a path
+            if (j > i or kinds[j] == v2.CSR_KIND_END) and dist[j] <= d:
+                dist[j] = d + 1
+    return [dist[s + 1] for s in csr.graph_offsets[:-1]]
+
+def compute_metrics(csr: v2.GraphCSR) -> list[dict]:
+    """One row per graph (module or function) of the run."""
+    seen = reachable(csr)
+    dead, dead_line = unreachable_counts(csr, seen)
+    cc = cyclomatic(csr, seen)
+    depth = loop_depth(csr)
+    longest = longest_path(csr)
+    bounds = csr.graph_offsets
+    return [{
+        "file": csr.files[csr.graph_file[g]],
+        "title": title,
+        "nodes": bounds[g + 1] - bounds[g],
+        "cyclomatic": cc[g],
+        "loop_depth": depth[g],
+        "longest_path": longest[g],
+        "unreachable": dead[g],
+        "first_unreachable_line": dead_line[g],
+    } for g, title in enumerate(csr.titles)]
+
+def write_csv(rows: list[dict], out_path: Path) -> bool:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=list(rows[0]) if rows else ["file", "title"], lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    return v2.write_if_changed(out_path, buf.getvalue())
+
+def main():
+    ap = argparse.ArgumentParser(description="Compute flowchart metrics for every function of a run from a py2mermaid_v2 --csr-out file.")
+    ap.add_argument("csr", help="batched CSR file written by py2mermaid_v2.py --csr-out")
+    ap.add_argument("--csv", default=None, metavar="PATH", help="write one row of metrics per function to this CSV file")
+    ap.add_argument("--top", type=int, default=10, help="how many functions to list per metric")
+    args = ap.parse_args()
+
+    try:
+        csr = v2.GraphCSR.load(Path(args.csr))
+    except (OSError, ValueError) as e:
+        print(f"[metrics] cannot load {args.csr}: {e}", file=sys.stderr)
+        sys.exit(2)
+    rows = compute_metrics(csr)
+    print(f"{len(rows)} graph(s), {len(csr.kinds)} node(s), {len(csr.indices)} edge(s) in {len(csr.files)} file(s)")
+
+    for metric in METRICS:
+        worst = sorted((r for r in rows if r[metric] > 0), key=lambda r: -r[metric])[:args.top]
+        if not worst:
+            continue
+        print(f"\n[{metric}]")
+        for r in worst:
+            where = f"{r['file']}:{r['first_unreachable_line']}" if metric == "unreachable" else r["file"]
+            print(f"  {r[metric]:>6}  {r['title']}  ({where})")
+
+    if args.csv:
+        changed = write_csv(rows, Path(args.csv))
+        print(f"\nWrote {args.csv}{'' if changed else ' (unchanged)'}")
+
+if __name__ == "__main__":
+    main()
@@ -21,32 +21,84 @@ Usage examples:
   # Both MD and HTML
   python py2mermaid_v2.py /path/to/project --format both --html-out mermaid.html --mermaid-zip mermaid-11.10.0.zip
 
+  # Queryable SQLite store (incremental; full-text search over node labels via the node_labels table)
+  python py2mermaid_v2.py /path/to/project --format sqlite --sqlite-out mermaid.sqlite
+
+  # Parse once, render many times: save the built graphs, then re-render with other options
+  python py2mermaid_v2.py /path/to/project --save-ir run.p2m
+  python py2mermaid_v2.py --from-ir run.p2m --format html --collapse --theme dark
+
+  # Full detail (one box per statement) instead of the default coarse skeleton + per-region sub-charts
+  python py2mermaid_v2.py /path/to/project --detail fine --out mermaid.md
+
+  # Whole-run metrics (unreachable code, cyclomatic complexity, loop depth, longest path)
+  python py2mermaid_v2.py /path/to/project --csr-out run.csr
+  python py2mermaid_metrics.py run.csr
+
+  # Review mode: before/after charts for functions changed between two git revisions
+  python py2mermaid_v2.py /path/to/repo --diff origin/main..HEAD --out review.md
+
 Notes:
 - The HTML mode tries to load Mermaid from either --mermaid-zip (preferred) or --mermaid-js.
 - If neither is given, it will still produce HTML but rely on a CDN fallback (requires internet).
 - For large projects, HTML rendering can be heavy; you can pass --collapse to make sections collapsible.
+- The HTML page embeds a compact JSON index and renders a virtualized, searchable table of contents;
+  a file's charts are only added to the DOM (and laid out by Mermaid) once it is navigated to.
+- Output is byte-stable for unchanged input (sorted scan order, positional node ids), and files are only
+  rewritten (atomically, via temp file + rename) when their content actually changes.
+- Generated files (*_pb2.py, parser tables, "DO NOT EDIT" / "@generated" headers) and files over
+  --max-file-bytes are skipped before parsing; --file-time-budget caps the build time of any one file.
+  Skipped files are listed in the run summary and do not count towards --max-files.
+- Charts default to the coarse level of detail (--detail coarse): conditions, loops, try/except, match/case,
+  returns and raises are kept and straight-line code is collapsed into "Rk: N statements" regions; each region
+  also gets a full-detail sub-chart titled "<chart> › Rk", which the HTML page only renders when expanded and
+  the Markdown output puts in a collapsed <details> block (combine_mermaid_blocks leaves them out by default).
+- --telemetry adds in-page instrumentation: every chart's parse and render time and SVG size are measured
+  (bypassing the SVG cache), an overlay lists the slowest charts with links, and "Export JSON" downloads
+  the measurements; "Render all" renders every chart of the report for a complete measurement.
+- Rendered SVGs are cached in the browser (IndexedDB) under each chart's content hash, so unchanged
+  charts are restored without re-layout on later visits (--svg-cache-mb caps the cache; 0 disables).
 
 License: MIT
 """
 
-import os, ast, sys, argparse, io, textwrap, html
+import os, re, ast, sys, time, argparse, io, textwrap, html, hashlib, subprocess, sqlite3, json, functools, tempfile, zlib, array, tokenize
 from pathlib import Path
-from typing import List, Tuple, Dict, Optional, Iterable
+from typing import List, Tuple, Dict, Optional, Iterable, Iterator, Union
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from zipfile import ZipFile
 
 # ---------------------------- Core CFG builder ---------------------------- #
 
 class Node:
-    __slots__ = ("kind", "label", "id", "nexts")
-    def __init__(self, kind: str, label: str):
+    __slots__ = ("kind", "label", "id", "nexts", "span", "ctl")
+    def __init__(self, kind: str, label: str, span: Optional[Tuple[int, int]] = None, ctl: bool = False):
         self.kind = kind  # "start", "op", "cond", "end"
         self.label = label
         self.id = None  # assigned later
         self.nexts: List["Node"] = []
+        self.span = span  # (first line, last line) of the source statement, if any
+        self.ctl = ctl  # control-flow op (try/except, match/case, joins, return/raise/...): kept in coarse charts
 
     def __repr__(self):
         return f"<Node {self.kind}:{self.label[:20]!r}>"
 
+# Mermaid label escapes, applied in this order (backslash first, CRLF before lone CR/LF)
+_MERMAID_LABEL_ESCAPES = {
+    "\\": "\\\\",
+    '"': '\\"',
+    "\r\n": "\\n",
+    "\r": "\\n",
+    "\n": "\\n",
+    "<": "&lt;",
+    ">": "&gt;",
+    "`": "\\`",
+}
+_MERMAID_LABEL_RE = re.compile(r'[\\"\r\n<>`]')
+_escaped_labels: Dict[str, str] = {}
+
 class Graph:
     def __init__(self, title: str):
         self.title = title
@@ -55,8 +107,8 @@ class Graph:
         self.end = self.add("end", "End")
         self._counter = 0
 
-    def add(self, kind: str, label: str) -> Node:
-        n = Node(kind, label)
+    def add(self, kind: str, label: str, span: Optional[Tuple[int, int]] = None, ctl: bool = False) -> Node:
+        n = Node(kind, label, span, ctl)
         n.id = f"n{len(self.nodes)}"
         self.nodes.append(n)
         return n
@@ -70,54 +122,94 @@ class Graph:
         """
         Escape a string so it is safe inside Mermaid node label quotes.
         We wrap labels as "...", so we must escape: backslash, double-quotes, newlines.
-        Also escape angle brackets to avoid accidental HTML interpretation in some renderers.
+        Also escape angle brackets to avoid accidental HTML interpretation in some renderers,
+        and backticks that would interfere with Markdown fences.
+        One regex scan finds the (rare) labels that need escaping; those are rewritten from the
+        _MERMAID_LABEL_ESCAPES table with C-level str.replace and memoized, since labels repeat a lot.
         """
         if text is None:
             return ""
         # Normalize to str
         text = str(text)
-        # Replace backslash *first*
-        text = text.replace("\\", "\\\\")
-        # Replace double quotes
-        text = text.replace('"', '\\"')
-        # Normalize CRLF -> LF, then Mermaid line break sequence
-        text = text.replace("\r\n", "\n").replace("\r", "\n")
-        text = text.replace("\n", "\\n")
-        # Escape angle brackets to be safe in strict security mode
-        text = text.replace("<", "&lt;").replace(">", "&gt;")
-        # Avoid stray backticks interfering with Markdown fences
-        text = text.replace("`", "\\`")
-        return text
+        if _MERMAID_LABEL_RE.search(text) is None:
+            return text  # the common case: nothing to escape
+        out = _escaped_labels.get(text)
+        if out is None:
+            out = text
+            for old, new in _MERMAID_LABEL_ESCAPES.items():
+                out = out.replace(old, new)
+            if len(_escaped_labels) >= 1 << 16:
+                _escaped_labels.clear()
+            _escaped_labels[text] = out
+        return out
 
-    def to_mermaid(self) -> str:
-        lines = ["flowchart TD"]
-        def fmt(n: Node) -> str:
-            text = Graph._esc_mermaid_label(n.label)
+    def write_mermaid(self, out) -> None:
+        """Stream the flowchart text into `out` (any object with .write), one node/edge at a time."""
+        esc = Graph._esc_mermaid_label
+        w = out.write
+        w("flowchart TD")
+        for n in self.nodes:
+            text = esc(n.label)
             if n.kind == "cond":
-                return f'{n.id}{{"{text}"}}'
-            elif n.kind == "end":
-                return f'{n.id}([ {text} ])'
-            elif n.kind == "start":
-                return f'{n.id}([ {text} ])'
+                w(f'\n    {n.id}{{"{text}"}}')
+            elif n.kind == "end" or n.kind == "start":
+                w(f'\n    {n.id}([ {text} ])')
             else:
-                return f'{n.id}["{text}"]'
-        for n in self.nodes:
-            lines.append(f"    {fmt(n)}")
+                w(f'\n    {n.id}["{text}"]')
         for n in self.nodes:
-            for idx, m in enumerate(n.nexts):
-                if n.kind == "cond":
-                    label = "True" if idx == 0 else ("False" if idx == 1 else "")
-                    if label:
-                        lines.append(f"    {n.id} -->|{label}| {m.id}")
+            if n.kind == "cond":
+                for idx, m in enumerate(n.nexts):
+                    if idx < 2:
+                        w(f"\n    {n.id} -->|{'True' if idx == 0 else 'False'}| {m.id}")
                     else:
-                        lines.append(f"    {n.id} --> {m.id}")
-                else:
-                    lines.append(f"    {n.id} --> {m.id}")
-        return "\n".join(lines)
+                        w(f"\n    {n.id} --> {m.id}")
+            else:
+                for m in n.nexts:
+                    w(f"\n    {n.id} --> {m.id}")
+
+    def to_mermaid(self) -> str:
+        buf = io.StringIO()
+        self.write_mermaid(buf)
+        return buf.getvalue()
+
+    @classmethod
+    def from_tables(cls, title: str, kinds: Iterable[str], labels: Iterable[str],
+                    spans: Iterable[Optional[Tuple[int, int]]], edges: Iterable[Tuple[int, int]],
+                    ctl: Iterable[int] = ()) -> "Graph":
+        """Rebuild a graph from per-node tables, (src, dst) index pairs in emission order and control-node indices."""
+        g = cls.__new__(cls)
+        g.title = title
+        g.nodes = []
+        g._counter = 0
+        for kind, label, span in zip(kinds, labels, spans):
+            g.add(kind, label, span)
+        g.start, g.end = g.nodes[0], g.nodes[1]
+        for i in ctl:
+            g.nodes[i].ctl = True
+        for a, b in edges:
+            g.nodes[a].nexts.append(g.nodes[b])
+        return g
+
+# What writers accept per chart: a built graph (streamed with write_mermaid) or Mermaid text already rendered
+Chart = Union[Graph, str]
+
+def write_chart(out, chart: Chart) -> None:
+    if isinstance(chart, str):
+        out.write(chart)
+    else:
+        chart.write_mermaid(out)
+
+_COMPOUND_STMTS = tuple(t for t in (ast.If, ast.For, getattr(ast, "AsyncFor", None), ast.While, ast.With,
+                                     getattr(ast, "AsyncWith", None), ast.Try, getattr(ast, "Match", None)) if t)
+
+class BuildBudgetExceeded(Exception):
+    """Raised when building a file's graphs runs past its wall-clock deadline."""
 
 class Builder(ast.NodeVisitor):
-    def __init__(self, title: str):
+    def __init__(self, title: str, deadline: Optional[float] = None):
         self.g = Graph(title)
+        self.deadline = deadline  # time.monotonic() value; None = no budget
+        self._steps = 0
 
     # ----------------- public entry points ----------------- #
     def build_module(self, node: ast.AST) -> Graph:
@@ -136,6 +228,7 @@ class Builder(ast.NodeVisitor):
         else:
             sig = str(func)
         self.g = Graph(sig)
+        self.g.start.span = self._span(func)
         last = self.g.start
         body = getattr(func, "body", [])
         last = self._build_block(body, last)
@@ -145,8 +238,33 @@ class Builder(ast.NodeVisitor):
     # -------------------- block/statement synthesizers -------------------- #
 
     def _build_block(self, stmts: List[ast.stmt], last: Node) -> Node:
+        """
+        Chain `stmts` after `last` and return the tail node.
+        Nested blocks are driven from an explicit stack of step generators instead of
+        Python recursion, so deeply nested code (e.g. long elif chains) cannot hit the recursion limit.
+        """
+        stack = [self._block_steps(stmts, last)]
+        tail = None
+        while stack:
+            try:
+                body, head = stack[-1].send(tail)
+            except StopIteration as stop:
+                stack.pop()
+                tail = stop.value
+                continue
+            stack.append(self._block_steps(body, head))
+            tail = None
+        return tail
+
+    def _block_steps(self, stmts: List[ast.stmt], last: Node):
         for s in stmts:
-            last = self._build_stmt(s, last)
+            self._steps += 1
+            if self.deadline is not None and not self._steps & 0xFF and time.monotonic() > self.deadline:
+                raise BuildBudgetExceeded("time budget exceeded")
+            if isinstance(s, _COMPOUND_STMTS):
+                last = yield from self._compound_steps(s, last)
+            else:
+                last = self._build_simple(s, last)
         return last
 
     def _label_expr(self, expr: Optional[ast.AST]) -> str:
@@ -159,160 +277,171 @@ class Builder(ast.NodeVisitor):
             # Fallback
             return expr.__class__.__name__
 
-    def _op(self, text: str) -> Node:
-        return self.g.add("op", text)
+    @staticmethod
+    def _span(src: Optional[ast.AST]) -> Optional[Tuple[int, int]]:
+        lineno = getattr(src, "lineno", None)
+        return (lineno, getattr(src, "end_lineno", None) or lineno) if lineno else None
+
+    def _op(self, text: str, src: Optional[ast.AST] = None) -> Node:
+        return self.g.add("op", text, self._span(src))
 
-    def _cond(self, text: str) -> Node:
-        return self.g.add("cond", text)
+    def _cond(self, text: str, src: Optional[ast.AST] = None) -> Node:
+        return self.g.add("cond", text, self._span(src))
 
-    # Main dispatcher
-    def _build_stmt(self, s: ast.stmt, last: Node) -> Node:
+    def _ctl(self, text: str, src: Optional[ast.AST] = None) -> Node:
+        return self.g.add("op", text, self._span(src), ctl=True)
+
+    # Compound statements: a step generator that yields (stmts, head) for every nested
+    # block it needs built and is sent back that block's tail node.
+    def _compound_steps(self, s: ast.stmt, last: Node):
         # ---- If / Elif / Else ----
         if isinstance(s, ast.If):
-            cond = self._cond(f"if {self._label_expr(s.test)}")
+            cond = self._cond(f"if {self._label_expr(s.test)}", s)
             self.g.link(last, cond)
-            true_tail = self._build_block(s.body, cond)
+            true_tail = (yield s.body, cond)
             if s.orelse:
-                false_tail = self._build_block(s.orelse, cond)
-                merge = self._op("merge")
+                false_tail = (yield s.orelse, cond)
+                merge = self._ctl("merge")
                 self.g.link(true_tail, merge)
                 self.g.link(false_tail, merge)
                 return merge
             else:
-                merge = self._op("merge")
+                merge = self._ctl("merge")
                 self.g.link(true_tail, merge)
                 self.g.link(cond, merge)  # false fall-through
                 return merge
 
         # ---- For / While / AsyncFor ----
         elif isinstance(s, ast.For):
-            hdr = self._cond(f"for {self._label_expr(s.target)} in {self._label_expr(s.iter)}")
+            hdr = self._cond(f"for {self._label_expr(s.target)} in {self._label_expr(s.iter)}", s)
             self.g.link(last, hdr)
-            body_tail = self._build_block(s.body, hdr)
+            body_tail = (yield s.body, hdr)
             self.g.link(body_tail, hdr)  # loop back
-            merge = self._op("after for")
+            merge = self._ctl("after for")
             self.g.link(hdr, merge)      # false branch (no iterations)
             return merge
 
         elif isinstance(s, getattr(ast, "AsyncFor", ast.For)):
             if isinstance(s, getattr(ast, "AsyncFor", ())):
-                hdr = self._cond(f"async for {self._label_expr(s.target)} in {self._label_expr(s.iter)}")
+                hdr = self._cond(f"async for {self._label_expr(s.target)} in {self._label_expr(s.iter)}", s)
                 self.g.link(last, hdr)
-                body_tail = self._build_block(s.body, hdr)
+                body_tail = (yield s.body, hdr)
                 self.g.link(body_tail, hdr)
-                merge = self._op("after async for")
+                merge = self._ctl("after async for")
                 self.g.link(hdr, merge)
                 return merge
 
         elif isinstance(s, ast.While):
-            hdr = self._cond(f"while {self._label_expr(s.test)}")
+            hdr = self._cond(f"while {self._label_expr(s.test)}", s)
             self.g.link(last, hdr)
-            body_tail = self._build_block(s.body, hdr)
+            body_tail = (yield s.body, hdr)
             self.g.link(body_tail, hdr)  # loop back
-            merge = self._op("after while")
+            merge = self._ctl("after while")
             self.g.link(hdr, merge)      # false branch
             return merge
 
         # ---- With / AsyncWith ----
         elif isinstance(s, ast.With):
             items = "; ".join([self._label_expr(it.context_expr) for it in s.items])
-            hdr = self._op(f"with {items}")
+            hdr = self._op(f"with {items}", s)
             self.g.link(last, hdr)
-            return self._build_block(s.body, hdr)
+            return (yield s.body, hdr)
 
         elif isinstance(s, getattr(ast, "AsyncWith", ast.With)):
             if isinstance(s, getattr(ast, "AsyncWith", ())):
                 items = "; ".join([self._label_expr(it.context_expr) for it in s.items])
-                hdr = self._op(f"async with {items}")
+                hdr = self._op(f"async with {items}", s)
                 self.g.link(last, hdr)
-                return self._build_block(s.body, hdr)
+                return (yield s.body, hdr)
 
         # ---- Try / Except / Finally ----
         elif isinstance(s, ast.Try):
-            hdr = self._op("try")
+            hdr = self._ctl("try", s)
             self.g.link(last, hdr)
-            try_tail = self._build_block(s.body, hdr)
+            try_tail = (yield s.body, hdr)
             exits = [try_tail]
             for h in s.handlers:
                 lab = f"except {self._label_expr(h.type) or ''}".strip()
-                hnode = self._op(lab)
+                hnode = self._ctl(lab, h)
                 self.g.link(hdr, hnode)
-                exits.append(self._build_block(h.body, hnode))
+                exits.append((yield h.body, hnode))
             # else: executed if no exception in try
             if s.orelse:
-                enode = self._op("else")
+                enode = self._ctl("else")
                 for e in [try_tail]:
                     self.g.link(e, enode)
-                else_tail = self._build_block(s.orelse, enode)
+                else_tail = (yield s.orelse, enode)
                 exits = [else_tail] + exits[1:]  # replace try-tail with else-tail
             if s.finalbody:
-                fnode = self._op("finally")
+                fnode = self._ctl("finally")
                 for e in exits:
                     self.g.link(e, fnode)
-                tail = self._build_block(s.finalbody, fnode)
+                tail = (yield s.finalbody, fnode)
                 return tail
             else:
-                merge = self._op("after try")
+                merge = self._ctl("after try")
                 for e in exits:
                     self.g.link(e, merge)
                 return merge
 
+        # ---- Match/Case (Py 3.10+) ----
+        elif hasattr(ast, "Match") and isinstance(s, getattr(ast, "Match")):
+            head = self._ctl(f"match {self._label_expr(s.subject)}", s)
+            self.g.link(last, head)
+            exits = []
+            for case in s.cases:
+                pat = getattr(case, "pattern", None)
+                guard = getattr(case, "guard", None)
+                label = f"case {self._label_expr(pat)}"
+                if guard is not None:
+                    label += f" if {self._label_expr(guard)}"
+                branch = self._ctl(label, pat)
+                self.g.link(head, branch)
+                exits.append((yield case.body, branch))
+            merge = self._ctl("after match")
+            for e in exits:
+                self.g.link(e, merge)
+            return merge
+
+    # Simple statements: one node, no nested blocks
+    def _build_simple(self, s: ast.stmt, last: Node) -> Node:
         # ---- Function / AsyncFunction / Class ----
-        elif isinstance(s, (ast.FunctionDef, getattr(ast, "AsyncFunctionDef", ast.FunctionDef))):
+        if isinstance(s, (ast.FunctionDef, getattr(ast, "AsyncFunctionDef", ast.FunctionDef))):
             label = f"def {s.name}(...)"
             if isinstance(s, getattr(ast, "AsyncFunctionDef", ())):
                 label = f"async {label}"
-            n = self._op(label)
+            n = self._op(label, s)
             self.g.link(last, n)
             return n
 
         elif isinstance(s, ast.ClassDef):
-            n = self._op(f"class {s.name}")
+            n = self._op(f"class {s.name}", s)
             self.g.link(last, n)
             return n
 
         # ---- Return / Raise / Break / Continue ----
         elif isinstance(s, ast.Return):
-            n = self._op(f"return {self._label_expr(s.value)}")
+            n = self._ctl(f"return {self._label_expr(s.value)}", s)
             self.g.link(last, n)
             self.g.link(n, self.g.end)  # show termination
             return n
 
         elif isinstance(s, ast.Raise):
-            n = self._op(f"raise {self._label_expr(s.exc)}")
+            n = self._ctl(f"raise {self._label_expr(s.exc)}", s)
             self.g.link(last, n)
             self.g.link(n, self.g.end)
             return n
 
         elif isinstance(s, ast.Break):
-            n = self._op("break")
+            n = self._ctl("break", s)
             self.g.link(last, n)
             return n
 
         elif isinstance(s, ast.Continue):
-            n = self._op("continue")
+            n = self._ctl("continue", s)
             self.g.link(last, n)
             return n
 
-        # ---- Match/Case (Py 3.10+) ----
-        elif hasattr(ast, "Match") and isinstance(s, getattr(ast, "Match")):
-            head = self._op(f"match {self._label_expr(s.subject)}")
-            self.g.link(last, head)
-            exits = []
-            for case in s.cases:
-                pat = getattr(case, "pattern", None)
-                guard = getattr(case, "guard", None)
-                label = f"case {self._label_expr(pat)}"
-                if guard is not None:
-                    label += f" if {self._label_expr(guard)}"
-                branch = self._op(label)
-                self.g.link(head, branch)
-                exits.append(self._build_block(case.body, branch))
-            merge = self._op("after match")
-            for e in exits:
-                self.g.link(e, merge)
-            return merge
-
         # ---- Simple statements (import, assign, expr, etc.) ----
         else:
             txt = type(s).__name__
@@ -323,14 +452,180 @@ class Builder(ast.NodeVisitor):
                     txt = ast.unparse(s.value).strip()
             except Exception:
                 pass
-            n = self._op(txt)
+            n = self._op(txt, s)
             self.g.link(last, n)
             return n
 
+# ---------------------------- Level of detail ---------------------------- #
+
+DETAIL_LEVELS = ("coarse", "fine")
+DETAIL_MARKER = " \u203a "  # "<chart title> › R3": fine-detail sub-chart of region R3 of a coarse chart
+
+def _is_join(n: Node) -> bool:
+    # "merge" / "after for" / ... are synthesized (no source span) and carry no information of their own
+    return n.ctl and n.span is None and len(n.nexts) == 1 and (n.label == "merge" or n.label.startswith("after "))
+
+def coarsen_graph(g: Graph) -> Tuple[Graph, List[Graph]]:
+    """
+    Coarse level of detail, derived from an already built (fine) graph: start/end, conditions and
+    control nodes (try/except, match/case, return/raise/break/continue) are kept, join nodes are
+    bypassed, and every straight-line chain of two or more plain statements becomes one
+    "Rk: N statements" node. Returns the coarse graph and, per collapsed region, a fine-detail
+    graph titled f"{g.title}{DETAIL_MARKER}Rk".
+    """
+    # Nested ifs end in chains of joins (merge -> merge -> ...); memoizing the chain's target with path
+    # compression keeps long elif chains linear instead of re-walking the chain from every edge.
+    resolved: Dict[Node, Node] = {}
+    def resolve(n: Node) -> Node:
+        path = []
+        while _is_join(n):
+            target = resolved.get(n)
+            if target is not None:
+                n = target
+                break
+            path.append(n)
+            n = n.nexts[0]
+        for j in path:
+            resolved[j] = n
+        return n
+
+    nexts: Dict[Node, List[Node]] = {}
+    indeg: Dict[Node, int] = {}
+    kept = [n for n in g.nodes if not _is_join(n)]
+    for n in kept:
+        out = nexts[n] = []
+        for m in n.nexts:
+            m = resolve(m)
+            if m not in out:
+                out.append(m)
+                indeg[m] = indeg.get(m, 0) + 1
+
+    def plain(n: Node) -> bool:
+        return n.kind == "op" and not n.ctl
+
+    def chain_next(n: Node) -> Optional[Node]:
+        if plain(n) and len(nexts[n]) == 1:
+            m = nexts[n][0]
+            if plain(m) and indeg[m] == 1:
+                return m
+        return None
+
+    inner = set()
+    for n in kept:
+        m = chain_next(n)
+        if m is not None:
+            inner.add(m)
+    region_of: Dict[Node, int] = {}
+    chains: List[List[Node]] = []
+    for n in kept:
+        if plain(n) and n not in inner and chain_next(n) is not None:
+            chain = [n]
+            while (m := chain_next(chain[-1])) is not None:
+                chain.append(m)
+            for c in chain:
+                region_of[c] = len(chains)
+            chains.append(chain)
+
+    coarse = Graph(g.title)
+    coarse.start.span = g.start.span
+    mapped: Dict[Node, Node] = {g.start: coarse.start, g.end: coarse.end}
+    regions: List[Node] = []
+    for n in kept[2:]:
+        k = region_of.get(n)
+        if k is None:
+            mapped[n] = coarse.add(n.kind, n.label, n.span, n.ctl)
+        elif k == len(regions):
+            chain = chains[k]
+            first, last = chain[0].span, chain[-1].span
+            span = (first[0], last[1]) if first and last else None
+            regions.append(coarse.add("op", f"R{k + 1}: {len(chain)} statements", span))
+            for c in chain:
+                mapped[c] = regions[k]
+    for n in kept:
+        k = region_of.get(n)
+        for m in nexts[n]:
+            if k is None or region_of.get(m) != k:  # edges inside a region disappear
+                coarse.link(mapped[n], mapped[m])
+
+    details = []
+    for k, chain in enumerate(chains, 1):
+        d = Graph(f"{g.title}{DETAIL_MARKER}R{k}")
+        last = d.start
+        for c in chain:
+            n = d.add(c.kind, c.label, c.span)
+            d.link(last, n)
+            last = n
+        d.link(last, d.end)
+        details.append(d)
+    return coarse, details
+
+def charts_for_graphs(graphs: Iterable[Graph], detail: str = "fine") -> List[Tuple[str, Graph]]:
+    """
+    (title, graph) pairs; coarse detail emits each coarse chart followed by its region sub-charts.
+    No Mermaid text is rendered here: writers stream each graph into their output with write_mermaid.
+    """
+    if detail == "fine":
+        return [(g.title, g) for g in graphs]
+    charts = []
+    for g in graphs:
+        coarse, details = coarsen_graph(g)
+        charts.append((coarse.title, coarse))
+        charts.extend((d.title, d) for d in details)
+    return charts
+
 # ---------------------------- Project scanner ---------------------------- #
 
-def scan_py_files(root: Path, ignore: List[str], max_files: int) -> List[Path]:
-    files: List[Path] = []
+_GENERATED_NAME_RE = re.compile(r"(?:_pb2|_pb2_grpc|parsetab|lextab)\.py$")
+# Established conventions only (Go's "Code generated ... DO NOT EDIT." is covered by "do not edit");
+# loose words like "auto-generated" also appear in ordinary hand-written headers.
+_GENERATED_MARKERS = (b"do not edit", b"@generated", b"generated by the protocol buffer compiler")
+_GENERATED_HEADER_BYTES = 2048
+
+class FileFilter:
+    """
+    Cheap pre-parse checks (file size, generated-code markers), applied while scanning or on the
+    reader threads of prefetch_sources; files rejected by scan_py_files are recorded in `skipped` as
+    (path, reason). Rejected files never count towards --max-files.
+    """
+    def __init__(self, max_bytes: int = 0, skip_generated: bool = True):
+        self.max_bytes = max_bytes
+        self.skip_generated = skip_generated
+        self.skipped: List[Tuple[Path, str]] = []
+
+    def reason(self, path: Path, data: Optional[bytes] = None) -> Optional[str]:
+        """Why path should be skipped (None = keep); pass the file's bytes when they are already read."""
+        if self.skip_generated and _GENERATED_NAME_RE.search(path.name):
+            return "generated (file name)"
+        try:
+            size = path.stat().st_size if data is None else len(data)
+            if self.max_bytes and size > self.max_bytes:
+                return f"too large ({size} bytes > {self.max_bytes})"
+            if self.skip_generated:
+                if data is None:
+                    with open(path, "rb") as fh:
+                        head = fh.read(_GENERATED_HEADER_BYTES)
+                else:
+                    head = data[:_GENERATED_HEADER_BYTES]
+                # only the leading comment block counts; markers quoted in code or strings are not headers
+                for line in head.splitlines():
+                    line = line.strip().lower()
+                    if line and not line.startswith(b"#"):
+                        break
+                    for marker in _GENERATED_MARKERS:
+                        if marker in line:
+                            return f"generated (header: {marker.decode()!r})"
+        except OSError as e:
+            return f"unreadable: {e}"
+        return None
+
+    def __call__(self, path: Path) -> bool:
+        why = self.reason(path)
+        if why is not None:
+            self.skipped.append((path, why))
+        return why is None
+
+def iter_py_files(root: Path, ignore: List[str], accept: Optional[FileFilter] = None) -> Iterator[Path]:
+    """Yield .py files under root in a stable (sorted) order while the walk is still in progress."""
     root = root.resolve()
     for dirpath, dirnames, filenames in os.walk(root):
         # apply ignore filters on directories early to prune traversal
@@ -344,49 +639,573 @@ def scan_py_files(root: Path, ignore: List[str], max_files: int) -> List[Path]:
             if any(token and token in full for token in ignore):
                 continue
             pruned.append(d)
-        dirnames[:] = pruned
+        # sorted, so the file order (and the --max-files cut-off) never depends on the filesystem
+        dirnames[:] = sorted(pruned)
 
-        for f in filenames:
+        for f in sorted(filenames):
             if f.endswith(".py"):
-                files.append(Path(dirpath) / f)
-                if len(files) >= max_files:
-                    return files
-    return files
+                path = Path(dirpath) / f
+                if accept is not None and not accept(path):
+                    continue
+                yield path
 
-def build_for_file(path: Path) -> List[Tuple[str, str]]:
-    """Return list of (title, mermaid_text) for module-level and each function."""
-    src = path.read_text(encoding="utf-8", errors="ignore")
-    tree = ast.parse(src, filename=str(path))
-    out: List[Tuple[str, str]] = []
+def scan_py_files(root: Path, ignore: List[str], max_files: int, accept: Optional[FileFilter] = None) -> List[Path]:
+    return list(islice(iter_py_files(root, ignore, accept), max_files))
+
+def decode_source(data: bytes) -> str:
+    """
+    Decode Python source the way the interpreter does (BOM, PEP 263 coding cookie, else UTF-8);
+    bytes that still do not decode become U+FFFD instead of being silently dropped.
+    """
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    except SyntaxError:  # unknown or conflicting coding cookie
+        encoding = "utf-8"
+    try:
+        return data.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        return data.decode("utf-8", errors="replace")
+
+def read_source(path: Path) -> str:
+    return decode_source(path.read_bytes())
+
+def _fetch_source(path: Path, accept: Optional[FileFilter]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    # Runs on a reader thread: (text, sha256 of the bytes read, None) or (None, None, skip reason).
+    # Oversized files are never read.
+    try:
+        if accept is not None and accept.max_bytes and path.stat().st_size > accept.max_bytes:
+            return None, None, accept.reason(path)
+        data = path.read_bytes()
+    except OSError as e:
+        return None, None, f"unreadable: {e}"
+    why = accept.reason(path, data) if accept is not None else None
+    if why is not None:
+        return None, None, why
+    return decode_source(data), hashlib.sha256(data).hexdigest(), None
+
+def prefetch_sources(paths: Iterable[Path],
+                     accept: Optional[FileFilter] = None,
+                     threads: int = 8) -> Iterator[Tuple[Path, Optional[str], Optional[str], Optional[str]]]:
+    """
+    Read, filter and decode files on a small thread pool while the caller parses them.
+    Yields (path, text, digest, None) or (path, None, None, skip reason) in input order, as soon as the
+    next file is ready; digest is the sha256 of exactly the bytes the text was decoded from, so stored
+    hashes always describe the charted content. At most 4 * threads reads are in flight;
+    threads=0 reads sequentially on the calling thread.
+    """
+    if threads <= 0:
+        for path in paths:
+            yield (path, *_fetch_source(path, accept))
+        return
+    limit = 4 * threads
+    window: deque = deque()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="p2m-read") as pool:
+        try:
+            for path in paths:
+                window.append((path, pool.submit(_fetch_source, path, accept)))
+                while window and (len(window) >= limit or window[0][1].done()):
+                    path, fut = window.popleft()
+                    yield (path, *fut.result())
+            while window:
+                path, fut = window.popleft()
+                yield (path, *fut.result())
+        finally:
+            for _, fut in window:  # the caller stopped early (e.g. --max-files): drop queued reads
+                fut.cancel()
+
+def _is_function_def(node: ast.AST) -> bool:
+    return isinstance(node, (ast.FunctionDef, getattr(ast, "AsyncFunctionDef", ast.FunctionDef)))
+
+_DEEP_PARSE_RECURSION_LIMIT = 50000
+
+def parse_source(src: str, filename: str = "<unknown>") -> ast.Module:
+    """ast.parse, retried with a raised recursion limit for deeply nested (e.g. generated) code."""
+    try:
+        return ast.parse(src, filename=filename)
+    except RecursionError:
+        pass
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, _DEEP_PARSE_RECURSION_LIMIT))
+    try:
+        return ast.parse(src, filename=filename)
+    finally:
+        sys.setrecursionlimit(limit)
+
+def build_graphs_for_source(src: str, name: str, filename: str = "<unknown>",
+                            deadline: Optional[float] = None) -> List[Graph]:
+    """
+    Return the module-level graph followed by one graph per top-level function.
+    With a deadline (time.monotonic() value), BuildBudgetExceeded is raised once it has passed;
+    ast.parse itself cannot be interrupted, so the size filter is what bounds parse time.
+    """
+    tree = parse_source(src, filename=filename)
+    if deadline is not None and time.monotonic() > deadline:
+        raise BuildBudgetExceeded("time budget exceeded while parsing")
 
     # module-level flow
-    b = Builder(title=f"{path.name} (module)")
-    g = b.build_module(tree)
-    out.append((g.title, g.to_mermaid()))
+    graphs = [Builder(title=f"{name} (module)", deadline=deadline).build_module(tree)]
 
     # functions (sync + async)
     for node in tree.body:
-        if isinstance(node, (ast.FunctionDef, getattr(ast, "AsyncFunctionDef", ast.FunctionDef))):
-            bf = Builder(title=f"{path.name}::{node.name}")
-            gf = bf.build_function(node)
-            out.append((gf.title, gf.to_mermaid()))
+        if _is_function_def(node):
+            graphs.append(Builder(title=f"{name}::{node.name}", deadline=deadline).build_function(node))
+    return graphs
+
+def build_graphs_for_file(path: Path, time_budget: float = 0) -> List[Graph]:
+    """Build a file's graphs; time_budget (seconds, 0 = unlimited) bounds reading, parsing and building."""
+    deadline = time.monotonic() + time_budget if time_budget else None
+    src = read_source(path)
+    return build_graphs_for_source(src, path.name, filename=str(path), deadline=deadline)
+
+def build_for_file(path: Path) -> List[Tuple[str, str]]:
+    """Return list of (title, mermaid_text) for module-level and each function."""
+    return [(g.title, g.to_mermaid()) for g in build_graphs_for_file(path)]
+
+# ---------------------------- Git diff mode ---------------------------- #
+
+def _git(root: Path, *args: str) -> bytes:
+    proc = subprocess.run(["git", "-C", str(root), *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        err = proc.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"git {' '.join(args)} failed: {err}")
+    return proc.stdout
+
+def parse_diff_range(root: Path, spec: str) -> Tuple[str, Optional[str]]:
+    """
+    Resolve "BASE..HEAD" into (base, head). "BASE...HEAD" diffs against the merge-base; an empty side
+    means HEAD in both forms, as in git. A bare "BASE" (head None) compares against the working tree.
+    """
+    if "..." in spec:
+        base, head = spec.split("...", 1)
+        head = head or "HEAD"
+        base = _git(root, "merge-base", base or "HEAD", head).decode("ascii").strip()
+        return base, head
+    if ".." in spec:
+        base, head = spec.split("..", 1)
+        return base or "HEAD", head or "HEAD"
+    return spec, None
+
+def git_changed_py_files(root: Path, base: str, head: Optional[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Return (old_path, new_path) pairs, relative to root, for .py files changed between base and head."""
+    args = ["diff", "--name-status", "-z", "-M", "--relative", base]
+    if head:
+        args.append(head)
+    args += ["--", "*.py"]
+    tokens = _git(root, *args).decode("utf-8", errors="surrogateescape").split("\0")
+    pairs: List[Tuple[Optional[str], Optional[str]]] = []
+    i = 0
+    while i < len(tokens) and tokens[i]:
+        status = tokens[i][0]
+        if status in "RC":
+            old, new = tokens[i + 1], tokens[i + 2]
+            i += 3
+        else:
+            old = new = tokens[i + 1]
+            i += 2
+        if status == "A" or status == "C":
+            old = None
+        elif status == "D":
+            new = None
+        pairs.append((old, new))
+    return pairs
+
+def _read_revision(root: Path, rev: Optional[str], rel: Optional[str]) -> Optional[str]:
+    if rel is None:
+        return None
+    if rev is None:
+        path = root / rel
+        return read_source(path) if path.exists() else None
+    return decode_source(_git(root, "show", f"{rev}:./{rel}"))
+
+def _fingerprint(node: ast.AST) -> str:
+    # Positions are excluded, so moving code around without editing it is not a change.
+    # Walked from an explicit stack (ast.dump recurses), so long elif chains that parse also fingerprint;
+    # node types, list lengths and scalar reprs in pre-order identify the tree unambiguously.
+    h = hashlib.sha1()
+    stack: List[object] = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, ast.AST):
+            h.update(f"({type(item).__name__}".encode("utf-8"))
+            stack.extend(value for _, value in reversed(list(ast.iter_fields(item))))
+        elif isinstance(item, list):
+            h.update(f"[{len(item)}".encode("utf-8"))
+            stack.extend(reversed(item))
+        else:
+            h.update(f"={item!r}\0".encode("utf-8"))
+    return h.hexdigest()
+
+def _module_fingerprint(tree: ast.Module) -> str:
+    # The module chart only shows nested defs/classes by name, so hash just that much of them.
+    parts = []
+    for node in tree.body:
+        if _is_function_def(node) or isinstance(node, ast.ClassDef):
+            parts.append(f"{type(node).__name__}:{node.name}")
+        else:
+            parts.append(_fingerprint(node))
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+def build_diff_for_file(name: str,
+                        old_src: Optional[str],
+                        new_src: Optional[str],
+                        base_label: str,
+                        head_label: str,
+                        detail: str = "fine") -> List[Tuple[str, Graph]]:
+    """
+    Return before/after (title, graph) pairs for the charts whose AST actually changed.
+    A side that does not parse is reported and treated as absent, so the other side is still charted.
+    """
+    def parse_side(src: Optional[str], label: str) -> Optional[ast.Module]:
+        if src is None:
+            return None
+        try:
+            return parse_source(src, filename=name)
+        except SyntaxError as e:
+            print(f"[skip] {name} @ {label} syntax error: {e}", file=sys.stderr)
+            return None
+
+    old_tree = parse_side(old_src, base_label)
+    new_tree = parse_side(new_src, head_label)
+
+    def functions(tree: Optional[ast.Module]) -> Dict[str, ast.AST]:
+        if tree is None:
+            return {}
+        return {node.name: node for node in tree.body if _is_function_def(node)}
+
+    out: List[Tuple[str, Graph]] = []
+    old_mod = _module_fingerprint(old_tree) if old_tree else None
+    new_mod = _module_fingerprint(new_tree) if new_tree else None
+    if old_mod != new_mod:
+        for tree, label in ((old_tree, f"before @ {base_label}"), (new_tree, f"after @ {head_label}")):
+            if tree is not None:
+                g = Builder(title=f"{name} (module)").build_module(tree)
+                out.extend((f"{title} \u2014 {label}", c) for title, c in charts_for_graphs([g], detail))
+
+    old_fns, new_fns = functions(old_tree), functions(new_tree)
+    names = list(new_fns) + [n for n in old_fns if n not in new_fns]
+    for fn in names:
+        before, after = old_fns.get(fn), new_fns.get(fn)
+        if before is not None and after is not None and _fingerprint(before) == _fingerprint(after):
+            continue
+        for node, label in ((before, f"before @ {base_label}"), (after, f"after @ {head_label}")):
+            if node is not None:
+                g = Builder(title=f"{name}::{fn}").build_function(node)
+                out.extend((f"{title} \u2014 {label}", c) for title, c in charts_for_graphs([g], detail))
     return out
 
+def collect_diff_charts(root: Path, spec: str, ignore: List[str],
+                        detail: str = "fine") -> Tuple[List[Path], Dict[Path, List[Tuple[str, Graph]]]]:
+    """
+    Chart only the functions that changed between two revisions of the git repo containing root.
+    RuntimeError is only raised for git failures; a file that cannot be charted is skipped.
+    """
+    base, head = parse_diff_range(root, spec)
+    base_label, head_label = base, head or "working tree"
+    files: List[Path] = []
+    charts_by_file: Dict[Path, List[Tuple[str, Graph]]] = {}
+    for old, new in sorted(git_changed_py_files(root, base, head), key=lambda p: p[1] or p[0]):
+        path = root / (new or old)
+        if any(token and token in str(path) for token in ignore):
+            continue
+        old_src = _read_revision(root, base, old)
+        new_src = _read_revision(root, head, new)
+        try:
+            charts = build_diff_for_file(path.name, old_src, new_src, base_label, head_label, detail)
+        except (RecursionError, MemoryError):  # the parser gives up on nesting it cannot handle with MemoryError
+            print(f"[skip] {path} too deeply nested to chart", file=sys.stderr)
+            continue
+        except Exception as e:
+            print(f"[skip] {path} error: {e}", file=sys.stderr)
+            continue
+        if charts:
+            files.append(path)
+            charts_by_file[path] = charts
+    return files, charts_by_file
+
+# ---------------------------- Intermediate graph format ---------------------------- #
+#
+# A built run saved as one zlib-compressed JSON document, so every writer (MD, HTML, SQLite, ...)
+# can re-render it with different options without re-scanning or re-parsing:
+#   {"format": "py2mermaid-ir", "version": 2, "root": ..., "strings": [label, ...],
+#    "files": [{"path": rel, "hash": sha256, "graphs": [
+#        {"title": ..., "kinds": "seock...", "labels": [string index, ...],
+#         "spans": [first, last, ...] (0, 0 = none), "edges": [src, dst, ...]}]}]}
+# Node kinds are one character each ("k" = control-flow op), labels point into the shared string table, and spans and
+# edges are flat integer arrays. Edges keep their emission order (it decides True/False branches).
+
+IR_FORMAT = "py2mermaid-ir"
+IR_VERSION = 2  # v2: control-flow ops are coded "k" (read as "op"); v1 files lack them and are rejected
+_IR_KIND_CODES = {"start": "s", "end": "e", "op": "o", "cond": "c"}
+_IR_KINDS = {v: k for k, v in _IR_KIND_CODES.items()}
+_IR_KINDS["k"] = "op"
+
+def save_ir(out_path: Path, root: Path, files: List[Path], graphs_by_file: Dict[Path, List[Graph]],
+            digests: Dict[Path, Optional[str]]) -> bool:
+    """
+    digests are the sha256 of the bytes each file's graphs were built from (prefetch_sources, load_ir);
+    sources are never re-read, so the saved hash always describes the saved graphs.
+    Written atomically and only when the bytes change; returns True if the file was written.
+    """
+    strings: List[str] = []
+    string_ids: Dict[str, int] = {}
+    def sid(text: str) -> int:
+        i = string_ids.get(text)
+        if i is None:
+            i = string_ids[text] = len(strings)
+            strings.append(text)
+        return i
+
+    out_files = []
+    for f in files:
+        graphs = []
+        for g in graphs_by_file[f]:
+            index = {n: i for i, n in enumerate(g.nodes)}
+            spans: List[int] = []
+            for n in g.nodes:
+                spans.extend(n.span or (0, 0))
+            graphs.append({
+                "title": g.title,
+                "kinds": "".join("k" if n.ctl else _IR_KIND_CODES[n.kind] for n in g.nodes),
+                "labels": [sid(n.label) for n in g.nodes],
+                "spans": spans,
+                "edges": [i for n in g.nodes for m in n.nexts for i in (index[n], index[m])],
+            })
+        out_files.append({"path": f.relative_to(root).as_posix(), "hash": digests.get(f), "graphs": graphs})
+    doc = {"format": IR_FORMAT, "version": IR_VERSION, "root": str(root), "strings": strings, "files": out_files}
+    data = zlib.compress(json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+    writer = AtomicBytesWriter(out_path)
+    with writer as fh:
+        fh.write(data)
+    return writer.changed
+
+def load_ir(path: Path) -> Tuple[Path, List[Path], Dict[Path, List[Graph]], Dict[Path, Optional[str]]]:
+    """
+    Load a saved run; returns (root, files, graphs_by_file, digests) ready for any writer.
+    digests are the sha256 of each source file when the run was saved, so no source needs to exist.
+    """
+    with open(path, "rb") as fh:
+        doc = json.loads(zlib.decompress(fh.read()).decode("utf-8"))
+    if doc.get("format") != IR_FORMAT or doc.get("version") != IR_VERSION:
+        raise ValueError(f"{path} is not a {IR_FORMAT} v{IR_VERSION} file")
+    root = Path(doc["root"])
+    strings = doc["strings"]
+    files: List[Path] = []
+    graphs_by_file: Dict[Path, List[Graph]] = {}
+    digests: Dict[Path, Optional[str]] = {}
+    for entry in doc["files"]:
+        f = root / entry["path"]
+        graphs = []
+        for g in entry["graphs"]:
+            sp, ed = g["spans"], g["edges"]
+            graphs.append(Graph.from_tables(
+                g["title"],
+                [_IR_KINDS[k] for k in g["kinds"]],
+                [strings[i] for i in g["labels"]],
+                [(sp[i], sp[i + 1]) if sp[i] else None for i in range(0, len(sp), 2)],
+                zip(ed[0::2], ed[1::2]),
+                [i for i, k in enumerate(g["kinds"]) if k == "k"]))
+        files.append(f)
+        graphs_by_file[f] = graphs
+        digests[f] = entry.get("hash")
+    return root, files, graphs_by_file, digests
+
+# ---------------------------- Batched CSR export ---------------------------- #
+#
+# Every graph of a run as one compressed-sparse-row structure over a single global node numbering,
+# for whole-run analyses (see py2mermaid_metrics.py) without re-parsing Mermaid text:
+#   graph_offsets[g] .. graph_offsets[g + 1]  nodes of graph g (start first, end second, build order)
+#   offsets[i] .. offsets[i + 1]              positions in `indices` of node i's successors (emission order)
+#   kinds / roles / lines / owner             per node: CSR_KIND_* code, CSR_ROLE_* bits, first source line
+#                                             (0 = none) and owning graph
+#   graph_file                                per graph: index into `files`
+# On disk: zlib( magic, u32 header length, JSON header, little-endian array bytes in header order ).
+
+CSR_FORMAT = "py2mermaid-csr"
+CSR_VERSION = 1
+_CSR_MAGIC = b"P2MCSR1\n"
+CSR_KIND_START, CSR_KIND_END, CSR_KIND_OP, CSR_KIND_COND = range(4)
+CSR_ROLE_CTL, CSR_ROLE_RETURN, CSR_ROLE_RAISE, CSR_ROLE_LOOP = 1, 2, 4, 8
+CSR_ROLE_TRY, CSR_ROLE_FINALLY, CSR_ROLE_TRY_EXIT = 16, 32, 64  # "try" / "finally" / "after try"
+_CSR_KINDS = {"start": CSR_KIND_START, "end": CSR_KIND_END, "op": CSR_KIND_OP, "cond": CSR_KIND_COND}
+_CSR_ARRAYS = (("graph_file", "i"), ("graph_offsets", "q"), ("offsets", "q"), ("indices", "i"),
+               ("kinds", "B"), ("roles", "B"), ("lines", "i"), ("owner", "i"))
+
+def _csr_role(n: Node) -> int:
+    # labels of control/cond nodes are synthesized by Builder, so their keyword prefixes are reliable
+    role = 0
+    if n.ctl:
+        role |= CSR_ROLE_CTL
+        if n.label == "return" or n.label.startswith("return "):
+            role |= CSR_ROLE_RETURN
+        elif n.label == "raise" or n.label.startswith("raise "):
+            role |= CSR_ROLE_RAISE
+        elif n.label == "try":
+            role |= CSR_ROLE_TRY
+        elif n.label == "finally":
+            role |= CSR_ROLE_FINALLY
+        elif n.label == "after try":
+            role |= CSR_ROLE_TRY_EXIT
+    elif n.kind == "cond" and n.label.startswith(("for ", "while ", "async for ")):
+        role |= CSR_ROLE_LOOP
+    return role
+
+class GraphCSR:
+    """All graphs of a run as flat arrays (see the layout above); `files` are root-relative posix paths."""
+    def __init__(self, root: str, files: List[str], titles: List[str], **arrays: array.array):
+        self.root = root
+        self.files = files
+        self.titles = titles
+        for name, code in _CSR_ARRAYS:
+            setattr(self, name, arrays.get(name, array.array(code)))
+
+    @classmethod
+    def from_graphs(cls, root: Path, files: List[Path], graphs_by_file: Dict[Path, List[Graph]]) -> "GraphCSR":
+        csr = cls(str(root), [f.relative_to(root).as_posix() for f in files], [])
+        csr.graph_offsets.append(0)
+        csr.offsets.append(0)
+        for fi, f in enumerate(files):
+            for g in graphs_by_file[f]:
+                gi = len(csr.titles)
+                base = csr.graph_offsets[-1]
+                index = {n: base + i for i, n in enumerate(g.nodes)}
+                csr.titles.append(g.title)
+                csr.graph_file.append(fi)
+                for n in g.nodes:
+                    csr.indices.extend(index[m] for m in n.nexts)
+                    csr.offsets.append(len(csr.indices))
+                    csr.kinds.append(_CSR_KINDS[n.kind])
+                    csr.roles.append(_csr_role(n))
+                    csr.lines.append(n.span[0] if n.span else 0)
+                    csr.owner.append(gi)
+                csr.graph_offsets.append(base + len(g.nodes))
+        return csr
+
+    def save(self, out_path: Path) -> bool:
+        """Written atomically and only when the bytes change; returns True if the file was written."""
+        header = {"format": CSR_FORMAT, "version": CSR_VERSION, "root": self.root, "files": self.files,
+                  "titles": self.titles, "arrays": [[name, code, len(getattr(self, name))] for name, code in _CSR_ARRAYS]}
+        head = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        z = zlib.compressobj(6)
+        chunks = [z.compress(_CSR_MAGIC + len(head).to_bytes(4, "little") + head)]
+        for name, _ in _CSR_ARRAYS:
+            arr = getattr(self, name)
+            if sys.byteorder == "big":
+                arr = array.array(arr.typecode, arr)
+                arr.byteswap()
+            chunks.append(z.compress(arr.tobytes()))
+        chunks.append(z.flush())
+        writer = AtomicBytesWriter(out_path)
+        with writer as fh:
+            fh.writelines(chunks)
+        return writer.changed
+
+    @classmethod
+    def load(cls, path: Path) -> "GraphCSR":
+        with open(path, "rb") as fh:
+            data = zlib.decompress(fh.read())
+        if not data.startswith(_CSR_MAGIC):
+            raise ValueError(f"{path} is not a {CSR_FORMAT} file")
+        pos = len(_CSR_MAGIC) + 4
+        size = int.from_bytes(data[len(_CSR_MAGIC):pos], "little")
+        header = json.loads(data[pos:pos + size].decode("utf-8"))
+        if header.get("format") != CSR_FORMAT or header.get("version") != CSR_VERSION:
+            raise ValueError(f"{path} is not a {CSR_FORMAT} v{CSR_VERSION} file")
+        pos += size
+        arrays = {}
+        for name, code, count in header["arrays"]:
+            arr = array.array(code)
+            end = pos + count * arr.itemsize
+            arr.frombytes(data[pos:end])
+            if sys.byteorder == "big":
+                arr.byteswap()
+            arrays[name] = arr
+            pos = end
+        return cls(header["root"], header["files"], header["titles"], **arrays)
+
 # ---------------------------- Output writers ---------------------------- #
 
-def write_markdown(root: Path, files: List[Path], charts_by_file: Dict[Path, List[Tuple[str, str]]], out_path: Path):
-    lines: List[str] = []
-    lines.append(f"# Mermaid Flowcharts for: {root}")
-    for i, f in enumerate(files, 1):
-        rel = f.relative_to(root)
-        lines.append(f"\n\n## {i}. {rel}")
-        for title, mer in charts_by_file[f]:
-            lines.append(f"\n### {title}\n")
-            lines.append("```mermaid")
-            lines.append(mer)
-            lines.append("```")
-    out_path.write_text("\n".join(lines), encoding="utf-8")
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class AtomicTextWriter:
+    """
+    Context manager that writes a text file through a temp file in the same folder.
+    On exit the temp file is dropped if its bytes equal the existing file (so mtimes stay put),
+    otherwise it atomically replaces the target. `changed` tells which happened.
+    """
+    def __init__(self, path: Path, encoding: str = "utf-8"):
+        self.path = Path(path)
+        self.encoding = encoding
+        self.changed = False
+
+    def __enter__(self):
+        fd, self._tmp = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp", dir=str(self.path.parent))
+        self._fh = self._open(fd)
+        return self._fh
+
+    def _open(self, fd: int):
+        return os.fdopen(fd, "w", encoding=self.encoding)
 
+    def __exit__(self, exc_type, exc, tb):
+        self._fh.close()
+        try:
+            if exc_type is None:
+                if self.path.exists() and os.path.getsize(self.path) == os.path.getsize(self._tmp) \
+                        and _file_digest(self.path) == _file_digest(self._tmp):
+                    return False
+                # mkstemp creates 0600 files; keep the target's mode, or the umask default for new files
+                if self.path.exists():
+                    mode = os.stat(self.path).st_mode & 0o777
+                else:
+                    umask = os.umask(0)
+                    os.umask(umask)
+                    mode = 0o666 & ~umask
+                os.chmod(self._tmp, mode)
+                os.replace(self._tmp, self.path)
+                self.changed = True
+        finally:
+            if os.path.exists(self._tmp):
+                os.unlink(self._tmp)
+        return False
+
+class AtomicBytesWriter(AtomicTextWriter):
+    """Binary variant of AtomicTextWriter (compressed IR / CSR files)."""
+    def __init__(self, path: Path):
+        super().__init__(path, encoding=None)
+
+    def _open(self, fd: int):
+        return os.fdopen(fd, "wb")
+
+def write_if_changed(path: Path, text: str, encoding: str = "utf-8") -> bool:
+    """Write text to path unless the file already holds exactly these bytes; returns True if it was written."""
+    writer = AtomicTextWriter(path, encoding)
+    with writer as fh:
+        fh.write(text)
+    return writer.changed
+
+def write_markdown(root: Path, files: List[Path], charts_by_file: Dict[Path, List[Tuple[str, Chart]]], out_path: Path):
+    # graphs are streamed straight into the (atomic) output file; no chart text is built in memory
+    with AtomicTextWriter(out_path) as fh:
+        fh.write(f"# Mermaid Flowcharts for: {root}")
+        for i, f in enumerate(files, 1):
+            rel = f.relative_to(root).as_posix()
+            fh.write(f"\n\n\n## {i}. {rel}")
+            for title, chart in charts_by_file[f]:
+                if DETAIL_MARKER in title:
+                    # region sub-charts of a coarse chart stay collapsed, like in the HTML page
+                    fh.write(f"\n\n<details>\n<summary>{html.escape(title)}</summary>\n\n```mermaid\n")
+                    write_chart(fh, chart)
+                    fh.write("\n```\n\n</details>")
+                else:
+                    fh.write(f"\n\n### {title}\n\n```mermaid\n")
+                    write_chart(fh, chart)
+                    fh.write("\n```")
+
+@functools.lru_cache(maxsize=4)  # extract the (multi-MB) runtime once per process
 def _read_mermaid_js(mermaid_zip: Optional[Path], mermaid_js: Optional[Path]) -> Optional[str]:
     # Priority 1: zip -> mermaid.min.js
     if mermaid_zip:
@@ -407,47 +1226,368 @@ def _read_mermaid_js(mermaid_zip: Optional[Path], mermaid_js: Optional[Path]) ->
             return jpath.read_text(encoding="utf-8", errors="ignore")
     return None
 
+# Client-side viewer: a virtualized TOC over the JSON index plus on-demand chart sections.
+# Kept as a plain string (not an f-string); per-page settings arrive through #p2m-config.
+_HTML_VIEWER_JS = r"""
+(function () {
+  "use strict";
+  var cfg = JSON.parse(document.getElementById("p2m-config").textContent);
+  var index = JSON.parse(document.getElementById("p2m-index").textContent);  // [[path, [title, ...], [hash, ...]], ...]
+  var charts = null;  // [[mermaid, ...], ...] parsed on first navigation
+  function chartData() {
+    if (!charts) charts = JSON.parse(document.getElementById("p2m-charts").textContent);
+    return charts;
+  }
+  function anchor(i, j) { return "f" + (i + 1) + (j < 0 ? "" : "-c" + (j + 1)); }
+
+  // ---- virtualized table of contents ----
+  var ROW_H = 24;
+  var fileRows = [], allRows = [];
+  index.forEach(function (entry, i) {
+    var row = { file: i, chart: -1, text: (i + 1) + ". " + entry[0], key: entry[0].toLowerCase() };
+    fileRows.push(row);
+    allRows.push(row);
+    entry[1].forEach(function (title, j) {
+      allRows.push({ file: i, chart: j, text: title, key: title.toLowerCase() });
+    });
+  });
+  var viewport = document.getElementById("toc-viewport");
+  var spacer = document.getElementById("toc-spacer");
+  var rowsEl = document.getElementById("toc-rows");
+  var countEl = document.getElementById("toc-count");
+  var visible = fileRows, painting = false;
+
+  function paint() {
+    spacer.style.height = (visible.length * ROW_H) + "px";
+    var first = Math.max(0, Math.floor(viewport.scrollTop / ROW_H) - 10);
+    var last = Math.min(visible.length, Math.ceil((viewport.scrollTop + viewport.clientHeight) / ROW_H) + 10);
+    rowsEl.style.top = (first * ROW_H) + "px";
+    var frag = document.createDocumentFragment();
+    for (var r = first; r < last; r++) {
+      var row = visible[r], a = document.createElement("a");
+      a.className = row.chart < 0 ? "toc-file" : "toc-chart";
+      a.href = "#" + anchor(row.file, row.chart);
+      a.textContent = row.chart < 0 ? row.text : row.text + "  —  " + index[row.file][0];
+      frag.appendChild(a);
+    }
+    rowsEl.replaceChildren(frag);
+    countEl.textContent = visible.length + (visible === fileRows ? " file(s)" : " match(es)");
+  }
+  viewport.addEventListener("scroll", function () {
+    if (painting) return;
+    painting = true;
+    requestAnimationFrame(function () { painting = false; paint(); });
+  });
+
+  // prefix (path or basename) > substring > fuzzy subsequence
+  function score(key, q) {
+    var at = key.indexOf(q);
+    if (at === 0 || key.indexOf("/" + q) !== -1) return 3;
+    if (at > 0) return 2;
+    var k = 0;
+    for (var c = 0; c < key.length && k < q.length; c++) {
+      if (key.charCodeAt(c) === q.charCodeAt(k)) k++;
+    }
+    return k === q.length ? 1 : 0;
+  }
+  document.getElementById("toc-search").addEventListener("input", function (ev) {
+    var q = ev.target.value.trim().toLowerCase();
+    if (!q) {
+      visible = fileRows;
+    } else {
+      var hits = [];
+      for (var r = 0; r < allRows.length; r++) {
+        var sc = score(allRows[r].key, q);
+        if (sc) hits.push({ row: allRows[r], sc: sc });
+      }
+      hits.sort(function (a, b) { return b.sc - a.sc; });  // stable: keeps file order within a score
+      visible = hits.map(function (h) { return h.row; });
+    }
+    viewport.scrollTop = 0;
+    paint();
+  });
+
+  // ---- chart sections, materialised on navigation ----
+  var main = document.getElementById("p2m-main");
+  var built = {};
+  var queue = Promise.resolve(), seq = 0;
+
+  // ---- IndexedDB cache of rendered SVGs, keyed by chart content hash ----
+  var svgCache = (function () {
+    if (!cfg.cacheBytes || !window.indexedDB) return null;
+    var dbp = new Promise(function (resolve) {
+      var req;
+      try { req = indexedDB.open("py2mermaid-svg-cache", 1); } catch (e) { resolve(null); return; }
+      req.onupgradeneeded = function () {
+        req.result.createObjectStore("svgs", { keyPath: "key" }).createIndex("used", "used");
+      };
+      req.onsuccess = function () { resolve(req.result); };
+      req.onerror = req.onblocked = function () { resolve(null); };
+    });
+    var evictTimer = null;
+    // Walk newest -> oldest and drop everything past the size cap.
+    function evict() {
+      evictTimer = null;
+      dbp.then(function (db) {
+        if (!db) return;
+        var total = 0;
+        db.transaction("svgs", "readwrite").objectStore("svgs").index("used").openCursor(null, "prev").onsuccess = function (ev) {
+          var cur = ev.target.result;
+          if (!cur) return;
+          total += cur.value.size;
+          if (total > cfg.cacheBytes) cur.delete();
+          cur.continue();
+        };
+      });
+    }
+    return {
+      get: function (key) {
+        return dbp.then(function (db) {
+          if (!db) return null;
+          return new Promise(function (resolve) {
+            var store = db.transaction("svgs", "readwrite").objectStore("svgs"), req = store.get(key);
+            req.onsuccess = function () {
+              var rec = req.result;
+              if (rec) {
+                rec.used = Date.now();
+                store.put(rec);
+              }
+              resolve(rec || null);
+            };
+            req.onerror = function () { resolve(null); };
+          });
+        });
+      },
+      put: function (key, rid, svg) {
+        dbp.then(function (db) {
+          if (!db) return;
+          db.transaction("svgs", "readwrite").objectStore("svgs")
+            .put({ key: key, rid: rid, svg: svg, size: svg.length, used: Date.now() });
+          if (!evictTimer) evictTimer = setTimeout(evict, 2000);
+        });
+      }
+    };
+  })();
+
+  // ---- optional render telemetry (--telemetry): parse/render time and SVG size per chart ----
+  var telemetry = cfg.telemetry ? [] : null;
+  var overlay = null, overlayTimer = null;
+  function now() { return window.performance ? performance.now() : Date.now(); }
+  function measure(pre, status, parseMs, renderMs, svgBytes) {
+    var i = +pre.dataset.file, j = +pre.dataset.chart;
+    telemetry.push({
+      file: index[i][0], title: index[i][1][j], anchor: anchor(i, j), hash: pre.dataset.hash, status: status,
+      parseMs: Math.round(parseMs * 10) / 10, renderMs: Math.round(renderMs * 10) / 10, svgBytes: svgBytes
+    });
+    if (!overlayTimer) overlayTimer = setTimeout(paintOverlay, 250);
+  }
+  function exportTelemetry() {
+    var doc = { generator: "py2mermaid_v2", runtime: cfg.cacheNs, userAgent: navigator.userAgent, charts: telemetry };
+    var a = document.createElement("a");
+    a.href = URL.createObjectURL(new Blob([JSON.stringify(doc, null, 2)], { type: "application/json" }));
+    a.download = "py2mermaid-telemetry.json";
+    document.body.appendChild(a);
+    a.click();
+    setTimeout(function () { URL.revokeObjectURL(a.href); a.remove(); }, 0);
+  }
+  function renderAll() {
+    for (var i = 0; i < index.length; i++) {
+      var pres = ensureSection(i).querySelectorAll("pre.mermaid");
+      for (var k = 0; k < pres.length; k++) render(pres[k]);
+    }
+  }
+  function paintOverlay() {
+    overlayTimer = null;
+    if (!overlay) {
+      overlay = document.createElement("aside");
+      overlay.id = "p2m-telemetry";
+      document.body.appendChild(overlay);
+    }
+    var total = 0;
+    telemetry.forEach(function (t) { total += t.parseMs + t.renderMs; });
+    var slowest = telemetry.slice().sort(function (a, b) {
+      return (b.parseMs + b.renderMs) - (a.parseMs + a.renderMs);
+    }).slice(0, 10);
+    var head = document.createElement("strong");
+    head.textContent = telemetry.length + " chart(s) rendered, " + Math.round(total) + " ms";
+    var list = document.createElement("ol");
+    slowest.forEach(function (t) {
+      var li = document.createElement("li"), a = document.createElement("a");
+      a.href = "#" + t.anchor;
+      a.textContent = t.title;
+      li.appendChild(a);
+      li.appendChild(document.createTextNode(" " + t.parseMs + " + " + t.renderMs + " ms, " +
+        (t.svgBytes / 1024).toFixed(1) + " KB" + (t.status === "error" ? " (error)" : "")));
+      list.appendChild(li);
+    });
+    var buttons = document.createElement("div");
+    [["Render all", renderAll], ["Export JSON", exportTelemetry], ["Hide", function () { overlay.hidden = true; }]]
+      .forEach(function (b) {
+        var btn = document.createElement("button");
+        btn.type = "button";
+        btn.textContent = b[0];
+        btn.addEventListener("click", b[1]);
+        buttons.appendChild(btn);
+      });
+    overlay.replaceChildren(head, list, buttons);
+  }
+
+  // Render ids are "p2m<n>s" so that no id is a substring of another; cached SVGs get re-labelled on restore.
+  // With telemetry on, cached SVGs are not restored, so every chart is measured.
+  function render(pre) {
+    if (pre.dataset.state) return;
+    pre.dataset.state = "queued";
+    var key = cfg.cacheNs + ":" + pre.dataset.hash;
+    (svgCache && !telemetry ? svgCache.get(key) : Promise.resolve(null)).then(function (rec) {
+      if (rec) {
+        pre.innerHTML = rec.svg.split(rec.rid).join("p2m" + (seq++) + "s");
+        pre.dataset.state = "cached";
+        return;
+      }
+      queue = queue.then(function () {
+        if (!window.mermaid) return;
+        var rid = "p2m" + (seq++) + "s", code = pre.textContent, t0 = now(), t1 = t0;
+        var parsed = telemetry && mermaid.parse ? Promise.resolve().then(function () {
+          return mermaid.parse(code);
+        }).then(function () { t1 = now(); }) : Promise.resolve();
+        return parsed.then(function () { return mermaid.render(rid, code); }).then(function (res) {
+          pre.innerHTML = res.svg;
+          pre.dataset.state = "done";
+          if (svgCache) svgCache.put(key, rid, res.svg);
+          if (telemetry) measure(pre, "done", t1 - t0, now() - t1, res.svg.length);
+        }, function (err) {
+          pre.dataset.state = "error";
+          pre.title = String((err && err.message) || err);
+          if (telemetry) measure(pre, "error", t1 - t0, now() - t1, 0);
+        });
+      });
+    });
+  }
+
+  function ensureSection(i) {
+    if (built[i]) return built[i];
+    var entry = index[i], codes = chartData()[i];
+    var sec = document.createElement("section");
+    sec.dataset.file = i;
+    var h2 = document.createElement("h2");
+    h2.id = anchor(i, -1);
+    h2.textContent = (i + 1) + ". " + entry[0];
+    sec.appendChild(h2);
+    codes.forEach(function (code, j) {
+      var pre = document.createElement("pre");
+      pre.className = "mermaid";
+      pre.dataset.hash = entry[2][j];
+      pre.dataset.file = i;
+      pre.dataset.chart = j;
+      pre.textContent = code;
+      // region sub-charts of a coarse chart are always collapsed and laid out only when expanded
+      if (cfg.collapse || entry[1][j].indexOf(cfg.detailMarker) !== -1) {
+        var det = document.createElement("details"), sum = document.createElement("summary");
+        det.id = anchor(i, j);
+        sum.textContent = entry[1][j];
+        det.appendChild(sum);
+        det.appendChild(pre);
+        det.addEventListener("toggle", function () { if (det.open) render(pre); });
+        sec.appendChild(det);
+      } else {
+        var h3 = document.createElement("h3");
+        h3.id = anchor(i, j);
+        h3.textContent = entry[1][j];
+        sec.appendChild(h3);
+        sec.appendChild(pre);
+        render(pre);
+      }
+    });
+    var next = null;
+    for (var c = main.firstElementChild; c; c = c.nextElementSibling) {
+      if (+c.dataset.file > i) { next = c; break; }
+    }
+    main.insertBefore(sec, next);
+    built[i] = sec;
+    return sec;
+  }
+
+  function go() {
+    var m = /^#f(\d+)(?:-c(\d+))?$/.exec(location.hash);
+    var i = m ? +m[1] - 1 : 0;
+    if (i < 0 || i >= index.length) return;
+    ensureSection(i);
+    if (!m) return;
+    var target = document.getElementById(location.hash.slice(1));
+    if (target) {
+      if (target.tagName === "DETAILS") target.open = true;
+      target.scrollIntoView();
+    }
+  }
+  window.addEventListener("hashchange", go);
+
+  document.addEventListener("DOMContentLoaded", function () {
+    if (window.mermaid && mermaid.initialize) {
+      mermaid.initialize({
+        startOnLoad: false,
+        theme: cfg.theme,
+        securityLevel: "strict",
+        flowchart: { htmlLabels: false }
+      });
+    }
+    paint();
+    go();
+    if (telemetry) paintOverlay();
+  });
+})();
+"""
+
+def _json_for_script(obj) -> str:
+    """Compact JSON that is safe to embed in a <script type="application/json"> element."""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).replace("<", "\\u003c")
+
+class _JsonStringWriter:
+    """
+    File-like sink that writes the text it is given as the body of a JSON string (script-safe, like
+    _json_for_script) into `out`, and hashes it, so a chart can be streamed into the page's JSON payload.
+    """
+    def __init__(self, out):
+        self.out = out
+        self.sha = hashlib.sha256()
+
+    def write(self, text: str) -> None:
+        self.sha.update(text.encode("utf-8"))
+        self.out.write(json.dumps(text, ensure_ascii=False)[1:-1].replace("<", "\\u003c"))
+
 def write_html(root: Path,
                files: List[Path],
-               charts_by_file: Dict[Path, List[Tuple[str, str]]],
+               charts_by_file: Dict[Path, List[Tuple[str, Chart]]],
                out_path: Path,
                mermaid_zip: Optional[Path],
                mermaid_js: Optional[Path],
                title: Optional[str] = None,
                theme: str = "default",
-               collapse: bool = False):
+               collapse: bool = False,
+               svg_cache_mb: int = 64,
+               mermaid_src: Optional[str] = None,
+               telemetry: bool = False):
     page_title = title or f"Mermaid Flowcharts for: {root}"
-    # Build TOC
-    toc_lines = []
-    for i, f in enumerate(files, 1):
-        rel = f.relative_to(root)
-        toc_lines.append(f'<li><a href="#f{i}">{i}. {html.escape(str(rel))}</a></li>')
-    toc_html = "<ul>" + "\n".join(toc_lines) + "</ul>"
-
-    # Sections
-    sections = []
-    for i, f in enumerate(files, 1):
-        rel = f.relative_to(root)
-        section_head = f'<h2 id="f{i}">{i}. {html.escape(str(rel))}</h2>'
-        inner = []
-        for title, mer in charts_by_file[f]:
-            safe_title = html.escape(title)
-            block = f'<h3>{safe_title}</h3>\n<pre class="mermaid">{html.escape(mer, quote=False)}</pre>'
-            if collapse:
-                block = f'<details><summary>{safe_title}</summary>\n<pre class="mermaid">{html.escape(mer, quote=False)}</pre>\n</details>'
-            inner.append(block)
-        sections.append(section_head + "\n" + "\n".join(inner))
-    body_html = "\n\n".join(sections)
 
     # Mermaid JS (embedded or CDN fallback)
     js_inline = _read_mermaid_js(mermaid_zip, mermaid_js)
     if js_inline is None:
         # Minimal fallback; requires internet
         js_tag = '<script defer src="https://cdn.jsdelivr.net/npm/mermaid@11/dist/mermaid.min.js"></script>'
+        runtime_id = "cdn-11"
     else:
-        js_tag = f"<script>{js_inline}</script>"
+        runtime_id = hashlib.sha1(js_inline.encode("utf-8")).hexdigest()[:12]
+        if mermaid_src:
+            # runtime shared between several pages (e.g. batch mode) instead of inlined
+            js_tag = f'<script src="{html.escape(mermaid_src)}"></script>'
+        else:
+            js_tag = f"<script>{js_inline}</script>"
+    runtime_note = "CDN fallback" if js_inline is None else ("shared file" if mermaid_src else "embedded")
+
+    # Cached SVGs depend on the theme and Mermaid build as well as the chart text.
+    config = {"theme": theme, "collapse": collapse, "detailMarker": DETAIL_MARKER, "telemetry": telemetry,
+              "cacheNs": f"{theme}/{runtime_id}", "cacheBytes": max(0, svg_cache_mb) * 1024 * 1024}
 
-    html_out = f"""<!doctype html>
+    head = f"""<!doctype html>
 <html lang="en">
 <head>
   <meta charset="utf-8">
@@ -457,72 +1597,308 @@ def write_html(root: Path,
     body {{ font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 2rem; }}
     h1, h2, h3 {{ line-height: 1.25; }}
     nav.toc {{ background: #f5f5f5; padding: 1rem; border-radius: 8px; }}
+    #toc-search {{ width: 100%; box-sizing: border-box; padding: .4rem; font: inherit; }}
+    #toc-viewport {{ position: relative; height: 40vh; overflow-y: auto; margin-top: .5rem; }}
+    #toc-spacer {{ position: relative; }}
+    #toc-rows {{ position: absolute; left: 0; right: 0; }}
+    #toc-rows a {{ display: block; height: 24px; line-height: 24px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }}
+    #toc-rows a.toc-chart {{ padding-left: 1.5rem; font-size: .9rem; }}
     pre.mermaid {{ background: #fff; padding: 0.5rem; border: 1px solid #ddd; border-radius: 6px; overflow: auto; }}
     details > summary {{ cursor: pointer; font-weight: 600; }}
     .meta {{ color: #555; font-size: 0.9rem; margin-top: .5rem; }}
+    #p2m-telemetry {{ position: fixed; right: 1rem; bottom: 1rem; max-width: 28rem; max-height: 50vh; overflow: auto;
+                      background: #fffbe6; border: 1px solid #d9c77a; border-radius: 6px; padding: .5rem .75rem;
+                      font-size: .85rem; box-shadow: 0 2px 8px rgba(0, 0, 0, .15); }}
+    #p2m-telemetry ol {{ margin: .4rem 0; padding-left: 1.4rem; }}
+    #p2m-telemetry button {{ margin-right: .4rem; }}
   </style>
   {js_tag}
-  <script>
-    // Initialize Mermaid 11
-    document.addEventListener("DOMContentLoaded", function() {{
-      if (window.mermaid && mermaid.initialize) {{
-        mermaid.initialize({{
-          startOnLoad: true,
-          theme: "{theme}",
-          securityLevel: "strict",
-          flowchart: {{ htmlLabels: false }}
-        }});
-      }}
-    }});
-  </script>
 </head>
 <body>
   <h1>{html.escape(page_title)}</h1>
-  <div class="meta">Generated by py2mermaid_v2. Mermaid runtime: {'embedded' if js_inline else 'CDN fallback'}.</div>
+  <div class="meta">Generated by py2mermaid_v2. Mermaid runtime: {runtime_note}.</div>
   <nav class="toc">
     <h2>Table of Contents</h2>
-    {toc_html}
+    <input id="toc-search" type="search" placeholder="Search files and functions" autocomplete="off">
+    <div class="meta" id="toc-count"></div>
+    <div id="toc-viewport"><div id="toc-spacer"><div id="toc-rows"></div></div></div>
   </nav>
-  {body_html}
+  <noscript>This report needs JavaScript to list and render its charts.</noscript>
+  <main id="p2m-main"></main>
+  <script type="application/json" id="p2m-config">{_json_for_script(config)}</script>
+  <script type="application/json" id="p2m-charts">"""
+    with AtomicTextWriter(out_path) as fh:
+        fh.write(head)
+        # Chart sources are streamed into the JSON payload; the compact index (files, chart titles,
+        # chart content hashes; anchors are derived from positions) is filled in on the way and follows.
+        # Sections are only built in the DOM when the reader navigates to them.
+        index = []
+        fh.write("[")
+        for i, f in enumerate(files):
+            fh.write("," if i else "")
+            titles, hashes = [], []
+            fh.write("[")
+            for j, (title, chart) in enumerate(charts_by_file[f]):
+                fh.write(',"' if j else '"')
+                sink = _JsonStringWriter(fh)
+                write_chart(sink, chart)
+                fh.write('"')
+                titles.append(title)
+                hashes.append(sink.sha.hexdigest()[:20])
+            fh.write("]")
+            index.append([f.relative_to(root).as_posix(), titles, hashes])
+        fh.write("]")
+        fh.write(f"""</script>
+  <script type="application/json" id="p2m-index">{_json_for_script(index)}</script>
+  <script>{_HTML_VIEWER_JS}</script>
 </body>
 </html>
+""")
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS functions (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    ordinal INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    mermaid TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS functions_file ON functions(file_id);
+CREATE INDEX IF NOT EXISTS functions_title ON functions(title);
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    function_id INTEGER NOT NULL REFERENCES functions(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    label TEXT NOT NULL,
+    UNIQUE (function_id, idx)
+);
+CREATE INDEX IF NOT EXISTS nodes_kind ON nodes(kind);
+CREATE TABLE IF NOT EXISTS edges (
+    function_id INTEGER NOT NULL REFERENCES functions(id) ON DELETE CASCADE,
+    src INTEGER NOT NULL,
+    dst INTEGER NOT NULL,
+    ord INTEGER NOT NULL,
+    PRIMARY KEY (function_id, src, ord)
+) WITHOUT ROWID;
 """
-    out_path.write_text(html_out, encoding="utf-8")
+
+# External-content FTS5 index over node labels, kept in sync with `nodes` by triggers.
+_SQLITE_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS node_labels USING fts5(label, content='nodes', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS nodes_ai AFTER INSERT ON nodes BEGIN
+    INSERT INTO node_labels(rowid, label) VALUES (new.id, new.label);
+END;
+CREATE TRIGGER IF NOT EXISTS nodes_ad AFTER DELETE ON nodes BEGIN
+    INSERT INTO node_labels(node_labels, rowid, label) VALUES ('delete', old.id, old.label);
+END;
+"""
+
+def _open_sqlite(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(_SQLITE_SCHEMA)
+    try:
+        conn.executescript(_SQLITE_FTS_SCHEMA)
+    except sqlite3.OperationalError as e:
+        print(f"[sqlite] full-text index disabled ({e})", file=sys.stderr)
+    return conn
+
+# Stored graphs are only valid for the generator that built them (py2mermaid_batch keys its chart cache on it too).
+GENERATOR_VERSION = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()[:12]
+
+def write_sqlite(root: Path, files: List[Path], graphs_by_file: Dict[Path, List[Graph]], out_path: Path,
+                 digests: Dict[Path, Optional[str]]) -> Tuple[int, int]:
+    """
+    Upsert files, functions, graphs and rendered Mermaid text into an SQLite database.
+    Files whose content hash is unchanged since the previous run (by the same generator version) are
+    left untouched, and files that are not part of this run (deleted, ignored, filtered or failed to
+    build) are dropped, so searches never return stale rows. Returns (updated, unchanged) file counts.
+    digests are the sha256 of the bytes each file's graphs were built from (prefetch_sources, load_ir);
+    the sources are never re-read, so a later edit cannot pair a new hash with old graphs and a saved
+    run needs no source tree. A file without a digest is always rewritten.
+    """
+    conn = _open_sqlite(out_path)
+    updated = unchanged = 0
+    try:
+        with conn:  # one transaction for the whole run
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('root', ?)", (str(root),))
+            known = dict(conn.execute("SELECT path, content_hash FROM files"))
+            row = conn.execute("SELECT value FROM meta WHERE key = 'generator'").fetchone()
+            current = known if row and row[0] == GENERATOR_VERSION else {}  # other generator: rebuild every file
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('generator', ?)", (GENERATOR_VERSION,))
+            in_run = set()
+            for f in files:
+                rel = f.relative_to(root).as_posix()
+                in_run.add(rel)
+                digest = digests.get(f) or ""
+                if digest and current.get(rel) == digest:
+                    unchanged += 1
+                    continue
+                # cascades to functions/nodes/edges (and the FTS index via triggers)
+                conn.execute("DELETE FROM files WHERE path = ?", (rel,))
+                file_id = conn.execute("INSERT INTO files(path, content_hash) VALUES (?, ?)", (rel, digest)).lastrowid
+                for ordinal, g in enumerate(graphs_by_file[f]):
+                    fn_id = conn.execute("INSERT INTO functions(file_id, ordinal, title, mermaid) VALUES (?, ?, ?, ?)",
+                                         (file_id, ordinal, g.title, g.to_mermaid())).lastrowid
+                    index = {n: i for i, n in enumerate(g.nodes)}
+                    conn.executemany("INSERT INTO nodes(function_id, idx, kind, label) VALUES (?, ?, ?, ?)",
+                                     [(fn_id, i, n.kind, n.label) for i, n in enumerate(g.nodes)])
+                    conn.executemany("INSERT INTO edges(function_id, src, dst, ord) VALUES (?, ?, ?, ?)",
+                                     [(fn_id, i, index[m], k) for i, n in enumerate(g.nodes) for k, m in enumerate(n.nexts)])
+                updated += 1
+            for rel in known:
+                if rel not in in_run:
+                    conn.execute("DELETE FROM files WHERE path = ?", (rel,))
+    finally:
+        conn.close()
+    return updated, unchanged
+
+def search_sqlite(db_path: Path, query: str, limit: int = 50) -> List[Tuple[str, str, str]]:
+    """Full-text search over node labels; returns (file path, function title, matching label) rows."""
+    conn = sqlite3.connect(str(db_path))
+    try:
+        return conn.execute(
+            "SELECT files.path, functions.title, nodes.label FROM node_labels"
+            " JOIN nodes ON nodes.id = node_labels.rowid"
+            " JOIN functions ON functions.id = nodes.function_id"
+            " JOIN files ON files.id = functions.file_id"
+            " WHERE node_labels MATCH ? ORDER BY rank LIMIT ?", (query, limit)).fetchall()
+    finally:
+        conn.close()
 
 # ---------------------------- CLI ---------------------------- #
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("root", help="project folder to scan")
+    ap.add_argument("root", nargs="?", default=None, help="project folder to scan (optional with --from-ir)")
     ap.add_argument("--out", default="mermaid.md", help="output Markdown file (when format includes md)")
     ap.add_argument("--html-out", default="mermaid.html", help="output HTML file (when format includes html)")
-    ap.add_argument("--format", choices=["md", "html", "both"], default="md", help="output format")
+    ap.add_argument("--sqlite-out", default="mermaid.sqlite", help="output SQLite database (when format is sqlite)")
+    ap.add_argument("--format", choices=["md", "html", "both", "sqlite"], default="md", help="output format")
     ap.add_argument("--max-files", type=int, default=500, help="max number of python files to process")
     ap.add_argument("--ignore", default="venv,.venv,site-packages,__pycache__,.git,.hg,.mypy_cache,.pytest_cache",
                     help="comma-separated substrings to ignore in paths")
+    ap.add_argument("--max-file-bytes", type=int, default=2_000_000,
+                    help="skip .py files larger than this before parsing; 0 disables the limit")
+    ap.add_argument("--include-generated", action="store_true",
+                    help="also chart generated files (*_pb2.py, parser tables, 'DO NOT EDIT' / '@generated' headers)")
+    ap.add_argument("--io-threads", type=int, default=8,
+                    help="threads reading files ahead of the parser (helps on network filesystems); 0 reads sequentially")
+    ap.add_argument("--file-time-budget", type=float, default=30.0, metavar="SECONDS",
+                    help="give up on a file whose graphs take longer than this to build; 0 disables the budget")
+    ap.add_argument("--detail", choices=DETAIL_LEVELS, default="coarse",
+                    help="coarse: branch/loop/try skeleton with straight-line code collapsed into regions, each "
+                         "region also charted in full; fine: one box per statement (md/html output)")
     ap.add_argument("--mermaid-zip", default=None, help="path to mermaid-11.x zip (will embed mermaid.min.js)")
     ap.add_argument("--mermaid-js", default=None, help="path to mermaid.min.js (if not using zip)")
     ap.add_argument("--title", default=None, help="override page title in HTML")
     ap.add_argument("--theme", default="default", help="Mermaid theme for HTML output")
     ap.add_argument("--collapse", action="store_true", help="collapse each function/module chart in HTML")
+    ap.add_argument("--telemetry", action="store_true",
+                    help="instrument the HTML page: per-chart parse/render time and SVG size, an overlay of the "
+                         "slowest charts and a JSON export")
+    ap.add_argument("--svg-cache-mb", type=int, default=64,
+                    help="size cap of the browser-side (IndexedDB) cache of rendered SVGs; 0 disables it")
+    ap.add_argument("--diff", default=None, metavar="BASE..HEAD",
+                    help="only chart functions changed between two git revisions (BASE..HEAD or BASE...HEAD, an empty side "
+                         "means HEAD as in git; a bare BASE compares against the working tree)")
+    ap.add_argument("--save-ir", default=None, metavar="PATH",
+                    help="also save the built graphs in the intermediate format for later re-rendering")
+    ap.add_argument("--csr-out", default=None, metavar="PATH",
+                    help="also export every graph of the run as one batched CSR file (input of py2mermaid_metrics.py)")
+    ap.add_argument("--from-ir", default=None, metavar="PATH",
+                    help="render from a saved intermediate file instead of scanning and parsing")
     args = ap.parse_args()
 
-    root = Path(args.root).resolve()
+    if args.root is None and not args.from_ir:
+        ap.error("root is required unless --from-ir is given")
+    root = Path(args.root).resolve() if args.root else None
     ignore = [s.strip() for s in args.ignore.split(",") if s.strip()]
-    files = scan_py_files(root, ignore, args.max_files)
+    charts_by_file: Dict[Path, List[Tuple[str, Chart]]] = {}
+    graphs_by_file: Dict[Path, List[Graph]] = {}
+    digests: Dict[Path, Optional[str]] = {}  # sha256 of the bytes each file's graphs were built from
 
-    if not files:
-        print("No .py files found.", file=sys.stderr)
-        sys.exit(1)
-
-    charts_by_file: Dict[Path, List[Tuple[str, str]]] = {}
-    for f in files:
+    if args.diff:
+        if args.format == "sqlite" or args.save_ir or args.from_ir or args.csr_out:
+            print("--diff only supports the md/html formats.", file=sys.stderr)
+            sys.exit(2)
         try:
-            charts_by_file[f] = build_for_file(f)
-        except SyntaxError as e:
-            print(f"[skip] {f} syntax error: {e}", file=sys.stderr)
-        except Exception as e:
-            print(f"[skip] {f} error: {e}", file=sys.stderr)
+            files, charts_by_file = collect_diff_charts(root, args.diff, ignore, args.detail)
+        except RuntimeError as e:
+            print(f"[diff] {e}", file=sys.stderr)
+            sys.exit(2)
+        if not files:
+            print(f"No changed functions for {args.diff}.", file=sys.stderr)
+            sys.exit(0)
+    elif args.from_ir:
+        try:
+            ir_root, files, graphs_by_file, digests = load_ir(Path(args.from_ir))
+        except (OSError, ValueError, zlib.error) as e:
+            print(f"[ir] cannot load {args.from_ir}: {e}", file=sys.stderr)
+            sys.exit(2)
+        root = root or ir_root
+        if root != ir_root:
+            # re-root the saved relative paths (e.g. the IR was built on another machine)
+            files = [root / f.relative_to(ir_root) for f in files]
+            graphs_by_file = {root / f.relative_to(ir_root): gs for f, gs in graphs_by_file.items()}
+            digests = {root / f.relative_to(ir_root): d for f, d in digests.items()}
+        print(f"Loaded {len(files)} file(s) from {args.from_ir}.")
+    else:
+        # reads (on --io-threads threads) overlap the walk and the parsing of earlier files
+        accept = FileFilter(args.max_file_bytes, skip_generated=not args.include_generated)
+        files = []
+        skipped = []
+        for f, src, digest, why in prefetch_sources(iter_py_files(root, ignore), accept, args.io_threads):
+            if why is not None:
+                skipped.append((f, why))
+                continue
+            files.append(f)
+            digests[f] = digest
+            deadline = time.monotonic() + args.file_time_budget if args.file_time_budget else None
+            try:
+                graphs_by_file[f] = build_graphs_for_source(src, f.name, filename=str(f), deadline=deadline)
+            except BuildBudgetExceeded:
+                skipped.append((f, f"over the {args.file_time_budget:g}s time budget"))
+            except SyntaxError as e:
+                print(f"[skip] {f} syntax error: {e}", file=sys.stderr)
+            except (RecursionError, MemoryError):
+                print(f"[skip] {f} too deeply nested to chart", file=sys.stderr)
+            except Exception as e:
+                print(f"[skip] {f} error: {e}", file=sys.stderr)
+            if len(files) >= args.max_files:
+                break
+
+        if not files:
+            print("No .py files found.", file=sys.stderr)
+            sys.exit(1)
+        # writers index charts_by_file by file, so drop the ones that failed to build
+        files = [f for f in files if f in graphs_by_file]
+        if skipped:
+            print(f"[summary] {len(skipped)} file(s) skipped by the pre-parse filters / time budget:", file=sys.stderr)
+            for f, why in skipped:
+                print(f"  {f.relative_to(root)}: {why}", file=sys.stderr)
+
+    if args.save_ir:
+        changed = save_ir(Path(args.save_ir), root, files, graphs_by_file, digests)
+        print(f"Wrote {args.save_ir} with {len(files)} file(s){'' if changed else ' (unchanged)'}.")
+
+    if args.csr_out:
+        csr = GraphCSR.from_graphs(root, files, graphs_by_file)
+        changed = csr.save(Path(args.csr_out))
+        print(f"Wrote {args.csr_out}: {len(csr.titles)} graph(s), {len(csr.kinds)} node(s), {len(csr.indices)} edge(s)"
+              f"{'' if changed else ' (unchanged)'}.")
+
+    if args.format in ("md", "html", "both") and not charts_by_file:
+        charts_by_file = {f: charts_for_graphs(graphs_by_file[f], args.detail) for f in files}
 
     if args.format in ("md", "both"):
         md_out = Path(args.out)
@@ -533,8 +1909,14 @@ def main():
         html_out = Path(args.html_out)
         mermaid_zip = Path(args.mermaid_zip) if args.mermaid_zip else None
         mermaid_js = Path(args.mermaid_js) if args.mermaid_js else None
-        write_html(root, files, charts_by_file, html_out, mermaid_zip, mermaid_js, args.title, args.theme, args.collapse)
+        write_html(root, files, charts_by_file, html_out, mermaid_zip, mermaid_js, args.title, args.theme, args.collapse,
+                   args.svg_cache_mb, telemetry=args.telemetry)
         print(f"Wrote {html_out} with {len(files)} file(s).")
 
+    if args.format == "sqlite":
+        db_out = Path(args.sqlite_out)
+        updated, unchanged = write_sqlite(root, files, graphs_by_file, db_out, digests)
+        print(f"Wrote {db_out}: {updated} file(s) updated, {unchanged} unchanged.")
+
 if __name__ == "__main__":
     main()
@@ -3,7 +3,7 @@
 """
 run_v3_then_combine.py - v3 (Base64 HTML embed)
 - Step 1: run py2mermaid_v3 to generate MD/HTML
-- Step 2: combine all ```mermaid blocks into a single .mmd
+- Step 2: combine all ```mermaid blocks into a single .mmd (streamed by combine_mermaid_blocks, constant memory)
 - Step 3: inject the combined diagram into the HTML using data-code-b64 (same mechanism as per-file charts)
 - Optional: include non-mermaid Markdown text as comments (%% ...) in the .mmd
 """
@@ -18,19 +18,10 @@ if str(HERE) not in sys.path:
 
 import py2mermaid_v3 as v3
 import combine_mermaid_blocks as cmb
+from py2mermaid_v2 import write_if_changed
 
 def md_non_mermaid_as_comments(md_text: str) -> str:
-    out_lines = []
-    in_code = False
-    for line in md_text.splitlines():
-        stripped = line.strip()
-        if stripped.startswith("```"):
-            in_code = not in_code
-            continue
-        if in_code:
-            continue
-        out_lines.append("%%" if stripped == "" else ("%% " + line))
-    return "\n".join(out_lines) + "\n"
+    return "".join(cmb.iter_comment_lines(md_text.splitlines()))
 
 def inject_combined_into_html(html_path: Path, combined_mmd: str, section_title: str = "Combined Diagram") -> None:
     html = html_path.read_text(encoding="utf-8", errors="replace")
@@ -56,7 +47,7 @@ def inject_combined_into_html(html_path: Path, combined_mmd: str, section_title:
             html = html[:idx] + snippet + html[idx:]
         else:
             html += snippet
-    html_path.write_text(html, encoding="utf-8")
+    write_if_changed(html_path, html)
 
 def run(root: Path,
         fmt: str,
@@ -110,22 +101,19 @@ def run(root: Path,
         wrote_md = True
         print(f"[v3] Also wrote Markdown (needed for combine): {md_out}")
 
-    md_text = Path(md_out).read_text(encoding="utf-8", errors="replace")
-    blocks = cmb.extract_blocks(md_text)
-    if not blocks:
+    # streamed Markdown -> .mmd, so the combine step runs in constant memory
+    n_blocks, n_skipped, changed = cmb.combine_markdown_file(Path(md_out), combined_out,
+                                                             flow_dir=flow_dir,
+                                                             include_md_text=include_md_text_in_mmd)
+    if not n_blocks:
         print(f"[combine] No ```mermaid blocks found in {md_out}", file=sys.stderr)
         sys.exit(3)
-
-    combined = cmb.combine_blocks(blocks, flow_dir=flow_dir)
-
-    if include_md_text_in_mmd:
-        combined = combined.rstrip() + "\n\n%% ---- Non-mermaid Markdown (as comments) ----\n" + md_non_mermaid_as_comments(md_text)
-
-    combined_out.write_text(combined, encoding="utf-8")
-    print(f"[combine] Combined {len(blocks)} block(s) -> {combined_out}")
+    skipped_note = f", {n_skipped} non-flowchart skipped" if n_skipped else ""
+    print(f"[combine] Combined {n_blocks} block(s){skipped_note} -> {combined_out}{'' if changed else ' (unchanged)'}")
 
     if embed_combined_into_html:
         if fmt in ("html", "both") and html_out.exists():
+            combined = combined_out.read_text(encoding="utf-8")
             inject_combined_into_html(html_out, combined_mmd=combined, section_title="Combined Diagram")
             print(f"[html] Embedded combined diagram into: {html_out}")
         else: